@@ -0,0 +1,140 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Firebase import
+from firebase_admin import firestore
+from firebase_functions import https_fn
+from firebase import db
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Other modules import
+import base64
+import hmac
+import json
+import threading
+import time
+from diet_index import ADHERENCE_FIELDS
+from prewarm import STUDY_TIMEZONE
+
+# Load environment variables
+load_dotenv()
+
+# Bearer token of the study staff; the endpoint is disabled while it is unset
+ADHERENCE_API_TOKEN = os.getenv('ADHERENCE_API_TOKEN', '')
+ADHERENCE_CACHE_SECONDS = float(os.getenv('ADHERENCE_CACHE_SECONDS', '60'))
+ADHERENCE_PAGE_SIZE = 200
+ADHERENCE_MAX_PAGE_SIZE = 500
+# Responses kept per instance; the oldest is dropped beyond this
+ADHERENCE_CACHE_ENTRIES = 256
+
+# missing=record / plan / both -> the date fields that must be before the requested day
+MISSING_FIELDS = {
+    'record': [ADHERENCE_FIELDS['record']],
+    'plan': [ADHERENCE_FIELDS['plan']],
+    'both': [ADHERENCE_FIELDS['record'], ADHERENCE_FIELDS['plan']],
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def encode_cursor(snapshot, fields):
+    values = {field: snapshot.get(field) for field in fields}
+    values['id'] = snapshot.id
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, fields):
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    # Any other JSON (a list, a number, non-string values) is a malformed cursor too, not a server error
+    if not isinstance(values, dict) or not all(isinstance(values.get(key), str) for key in (*fields, 'id')):
+        raise ValueError("Malformed cursor")
+    start = {field: values[field] for field in fields}
+    start['__name__'] = values['id']
+    return start
+
+def query_missing(collection, date, missing, page_size, cursor=None):
+    # Users whose last plan / record is before `date`; ordered on the filtered fields so
+    # the query is served by the (last_record_date, last_plan_date) composite index
+    fields = MISSING_FIELDS[missing]
+    query = db.collection(collection)
+    for field in fields:
+        query = query.where(filter=firestore.FieldFilter(field, '<', date))
+    for field in fields:
+        query = query.order_by(field)
+    query = query.order_by(FieldPath.document_id()) \
+        .select(list(ADHERENCE_FIELDS.values())) \
+        .limit(page_size)
+    if cursor:
+        query = query.start_after(decode_cursor(cursor, fields))
+
+    snapshots = list(query.stream())
+    users = [
+        {'user_id': snapshot.id, **{field: snapshot.get(field) for field in ADHERENCE_FIELDS.values()}}
+        for snapshot in snapshots
+    ]
+    next_cursor = encode_cursor(snapshots[-1], fields) if len(snapshots) == page_size else None
+    return {'date': date, 'missing': missing, 'users': users, 'next_cursor': next_cursor}
+
+def cached_query(key, compute):
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1], True
+    result = compute()
+    with _cache_lock:
+        _cache[key] = (now + ADHERENCE_CACHE_SECONDS, result)
+        while len(_cache) > ADHERENCE_CACHE_ENTRIES:
+            _cache.pop(next(iter(_cache)))
+    return result, False
+
+def authorized(req):
+    if not ADHERENCE_API_TOKEN:
+        return False
+    header = req.headers.get('Authorization', '')
+    return hmac.compare_digest(header, f"Bearer {ADHERENCE_API_TOKEN}")
+
+def adherence_handler(req: https_fn.Request, arms) -> https_fn.Response:
+    # GET ?arm=experiment&missing=record&date=YYYY-MM-DD&page_size=200&cursor=...
+    # Read-only: user IDs with their last plan and record dates, nothing from the conversations
+    if req.method != 'GET':
+        return https_fn.Response(response="Method not allowed", status=405)
+    if not authorized(req):
+        return https_fn.Response(response="Unauthorized", status=401)
+
+    collections = {arm.name: arm.collection for arm in arms}
+    arm = req.args.get('arm', 'experiment')
+    missing = req.args.get('missing', 'record')
+    # Default: today on the participants' clock, the day the adherence fields are dated in
+    date = req.args.get('date') or datetime.now(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d")
+    cursor = req.args.get('cursor') or None
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+        page_size = min(int(req.args.get('page_size', ADHERENCE_PAGE_SIZE)), ADHERENCE_MAX_PAGE_SIZE)
+        if arm not in collections or missing not in MISSING_FIELDS or page_size <= 0:
+            raise ValueError(f"Unknown arm or missing: {arm}, {missing}")
+        if cursor:
+            decode_cursor(cursor, MISSING_FIELDS[missing])
+    except (ValueError, KeyError) as e:
+        return https_fn.Response(response=f"Invalid query: {e}", status=400)
+
+    started = time.monotonic()
+    try:
+        result, cached = cached_query(
+            (arm, missing, date, page_size, cursor),
+            lambda: query_missing(collections[arm], date, missing, page_size, cursor)
+        )
+    except Exception as e:
+        print(f"Error querying adherence: {e}")
+        return https_fn.Response(response="Error", status=500)
+    print(f"Adherence query {arm}/{missing}/{date}: {len(result['users'])} users, "
+          f"{'cached' if cached else 'queried'} in {time.monotonic() - started:.3f}s")
+    return https_fn.Response(
+        response=json.dumps(dict(result, arm=arm), ensure_ascii=False),
+        status=200,
+        headers={'Cache-Control': f"private, max-age={int(ADHERENCE_CACHE_SECONDS)}"},
+        content_type='application/json'
+    )
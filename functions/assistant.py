@@ -0,0 +1,141 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# OpenAI import
+from openai import OpenAI
+
+# Other modules import
+import time
+import re
+from deadline import DEADLINE_RESERVE_SECONDS, DeadlineExceeded
+from retry import call_with_retry
+
+# Load environment variables
+load_dotenv()
+
+# Seconds between two polls of an Assistant run
+RUN_POLL_INTERVAL = 1
+# Least budget worth starting a new Assistant run with
+MIN_RUN_SECONDS = 10
+
+# OpenAI API Initialization
+# Retries are handled by retry.py, which only retries idempotent calls
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+ASSISTANT_ID = os.getenv('ASSISTANT_ID')
+
+
+# ====== GPT Assistant Functions ======
+def create_thread(deadline):
+    thread = client.beta.threads.create(timeout=deadline.timeout('threads.create'))
+    return thread.id
+
+def add_message_to_thread(thread_id, user_message, deadline):
+    client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=user_message,
+        timeout=deadline.timeout('messages.create')
+    )
+
+def add_image_to_thread(thread_id, image, deadline):
+    # `image` is JPEG bytes; the Assistant model must support image input
+    file = client.files.create(
+        file=('photo.jpg', image, 'image/jpeg'),
+        purpose='vision',
+        timeout=deadline.timeout('files.create')
+    )
+    client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=[{'type': 'image_file', 'image_file': {'file_id': file.id}}],
+        timeout=deadline.timeout('messages.create')
+    )
+
+def cancel_run(thread_id, run_id, deadline):
+    # Best effort, so the thread accepts new messages on the next request
+    try:
+        client.beta.threads.runs.cancel(
+            thread_id=thread_id,
+            run_id=run_id,
+            timeout=deadline.timeout('runs.cancel', reserve=0, cap=3)
+        )
+    except Exception as e:
+        print(f"Error cancelling run {run_id}: {e}")
+
+def run_usage(run, polls, started):
+    # Usage of one Run for the usage ledger; token counts are only set once the Run ends
+    usage = getattr(run, 'usage', None)
+    return {
+        'run_id': run.id,
+        'status': run.status,
+        'polls': polls,
+        'duration': round(time.monotonic() - started, 3),
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+        'total_tokens': getattr(usage, 'total_tokens', 0) or 0,
+    }
+
+def run_assistant(thread_id, deadline, runs=None):
+    # `runs` collects the usage of every Run, also of the ones that fail or time out
+    started = time.monotonic()
+    run = client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_ID,
+        timeout=deadline.timeout('runs.create')
+    )
+
+    # Poll for Run completion while the request budget allows it
+    run_status = run
+    polls = 0
+    try:
+        while True:
+            run_status = call_with_retry('openai', lambda: client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id,
+                timeout=deadline.timeout('runs.retrieve')
+            ), deadline)
+            polls += 1
+            if run_status.status == 'completed':
+                break
+            elif run_status.status == 'cancelled':
+                print(f"Run {run.id} was cancelled.")
+                return "CANCELLED"
+            elif run_status.status in ['failed']:
+                raise Exception("Assistant run failed.")
+            deadline.check('runs.retrieve', reserve=DEADLINE_RESERVE_SECONDS + RUN_POLL_INTERVAL)
+            time.sleep(RUN_POLL_INTERVAL)  # Add delay to avoid excessive requests
+    except DeadlineExceeded:
+        cancel_run(thread_id, run.id, deadline)
+        raise
+    finally:
+        if runs is not None:
+            runs.append(run_usage(run_status, polls, started))
+
+    # Get reply message
+    messages = call_with_retry('openai', lambda: client.beta.threads.messages.list(
+        thread_id=thread_id,
+        timeout=deadline.timeout('messages.list')
+    ), deadline)
+    return messages.data[0].content[0].text.value
+
+def remove_markdown(text):
+    # Turn markdown to plain text
+    # Remove bold and italic tags
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # **粗體**
+    text = re.sub(r'\*(.*?)\*', r'\1', text)      # *斜體*
+    
+    # Remove title tags
+    text = re.sub(r'^#+\s', '', text, flags=re.MULTILINE)  # # 標題
+    
+    # Remove link tags
+    text = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', text)  # [文字](連結)
+    
+    # Remove code block tags
+    text = re.sub(r'```(.*?)```', r'\1', text, flags=re.DOTALL)  # ```程式碼區塊```
+    text = re.sub(r'`(.*?)`', r'\1', text)  # `行內程式碼`
+    
+    # Remove quote tags
+    text = re.sub(r'^>\s', '', text, flags=re.MULTILINE)  # > 引用
+    
+    return text
@@ -0,0 +1,96 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+from datetime import datetime
+
+# Other modules import
+import json
+import hmac
+import hashlib
+import threading
+import uuid
+from deadline import current_deadline
+
+# Load environment variables
+load_dotenv()
+
+# Off when empty; a local directory ("/tmp/webhooks") or a Storage prefix ("gs://bucket/webhooks")
+WEBHOOK_CAPTURE = os.getenv('WEBHOOK_CAPTURE', '')
+# Key of the user ID pseudonyms, keep it stable to keep a participant's traffic linked across captures.
+# Required: without it a pseudonym is a plain hash anyone holding the LINE user IDs can reverse
+WEBHOOK_CAPTURE_SALT = os.getenv('WEBHOOK_CAPTURE_SALT', '')
+PSEUDONYMIZED_KEYS = ('userId', 'groupId', 'roomId')
+# Longest a capture upload may hold up the webhook it records (seconds); also bounded by the request deadline
+WEBHOOK_CAPTURE_TIMEOUT_SECONDS = float(os.getenv('WEBHOOK_CAPTURE_TIMEOUT_SECONDS', '2'))
+
+_file_lock = threading.Lock()
+_salt_warned = False
+
+
+def pseudonymize(value):
+    # Same shape as a LINE ID ("U" + 32 hex characters)
+    digest = hmac.new(WEBHOOK_CAPTURE_SALT.encode('utf-8'), value.encode('utf-8'), hashlib.sha256).hexdigest()
+    return value[:1] + digest[:32]
+
+def pseudonymize_ids(node):
+    if isinstance(node, dict):
+        return {
+            key: pseudonymize(value) if key in PSEUDONYMIZED_KEYS and isinstance(value, str) else pseudonymize_ids(value)
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [pseudonymize_ids(value) for value in node]
+    return node
+
+def write_record(record):
+    day = datetime.fromtimestamp(record['received_at']).strftime("%Y-%m-%d")
+    if WEBHOOK_CAPTURE.startswith('gs://'):
+        from firebase_admin import storage
+
+        bucket_name, _, prefix = WEBHOOK_CAPTURE[len('gs://'):].partition('/')
+        name = f"{prefix.rstrip('/')}/{day}/{record['received_at']:.6f}-{uuid.uuid4().hex[:8]}.json".lstrip('/')
+        storage.bucket(bucket_name).blob(name).upload_from_string(
+            json.dumps(record, ensure_ascii=False), content_type='application/json',
+            timeout=current_deadline().timeout('capture.upload', cap=WEBHOOK_CAPTURE_TIMEOUT_SECONDS)
+        )
+    else:
+        os.makedirs(WEBHOOK_CAPTURE, exist_ok=True)
+        path = os.path.join(WEBHOOK_CAPTURE, f"webhooks-{day}-{os.getpid()}.jsonl")
+        with _file_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def capture_webhook(arm, body, received_at):
+    # Record a raw webhook body with its arrival time for later replay, never failing the request
+    if not WEBHOOK_CAPTURE:
+        return
+    if not WEBHOOK_CAPTURE_SALT:
+        global _salt_warned
+        if not _salt_warned:
+            print("WEBHOOK_CAPTURE_SALT is not set, webhooks are not captured")
+            _salt_warned = True
+        return
+    try:
+        write_record({
+            'arm': arm,
+            'received_at': received_at,
+            'body': json.dumps(pseudonymize_ids(json.loads(body)), ensure_ascii=False, separators=(',', ':'))
+        })
+    except Exception as e:
+        print(f"Error capturing webhook: {e}")
+
+def load_records(source):
+    # Captured records from a local directory or a Storage prefix, in arrival order
+    records = []
+    if source.startswith('gs://'):
+        from firebase_admin import storage
+
+        bucket_name, _, prefix = source[len('gs://'):].partition('/')
+        for blob in storage.bucket(bucket_name).list_blobs(prefix=prefix):
+            records.append(json.loads(blob.download_as_text()))
+    else:
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.jsonl'):
+                with open(os.path.join(source, name), encoding='utf-8') as f:
+                    records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['received_at'])
+    return records
@@ -0,0 +1,69 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Other modules import
+import time
+from contextvars import ContextVar
+
+# Load environment variables
+load_dotenv()
+
+# Hard timeout of the Cloud Function (seconds), shared with main.py
+FUNCTION_TIMEOUT_SECONDS = int(os.getenv('FUNCTION_TIMEOUT_SECONDS', '60'))
+# Budget kept aside so the pipeline can always reply and persist state before the hard timeout
+DEADLINE_RESERVE_SECONDS = float(os.getenv('DEADLINE_RESERVE_SECONDS', '5'))
+# Smallest timeout worth giving to a single network call
+MIN_CALL_SECONDS = 1.0
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage, remaining):
+        super().__init__(f"Deadline budget exhausted before '{stage}' ({remaining:.2f}s left)")
+        self.stage = stage
+        self.remaining = remaining
+
+
+class Deadline:
+    # Request-scoped time budget, started when the webhook arrives
+    def __init__(self, budget=FUNCTION_TIMEOUT_SECONDS, started_at=None):
+        self.budget = budget
+        self.started_at = started_at if started_at is not None else time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def remaining(self):
+        return self.budget - self.elapsed()
+
+    def has_budget(self, seconds, reserve=DEADLINE_RESERVE_SECONDS):
+        return self.remaining() - reserve >= seconds
+
+    def check(self, stage, reserve=DEADLINE_RESERVE_SECONDS):
+        # Raise if there is not enough budget left to start the given stage
+        remaining = self.remaining()
+        if remaining - reserve < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(stage, remaining)
+        return remaining - reserve
+
+    def timeout(self, stage, reserve=DEADLINE_RESERVE_SECONDS, cap=None):
+        # Timeout (seconds) to hand to a single Firestore / LINE / OpenAI call
+        budget = self.check(stage, reserve)
+        if cap is not None:
+            budget = min(budget, cap)
+        return budget
+
+
+# Deadline of the webhook currently being handled (LINE SDK handlers only receive the event)
+_current_deadline = ContextVar('current_deadline', default=None)
+
+def start_deadline(budget=FUNCTION_TIMEOUT_SECONDS):
+    deadline = Deadline(budget)
+    _current_deadline.set(deadline)
+    return deadline
+
+def current_deadline():
+    deadline = _current_deadline.get()
+    if deadline is None:
+        deadline = start_deadline()
+    return deadline
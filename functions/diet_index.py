@@ -0,0 +1,109 @@
+# Firebase import
+from firebase_admin import firestore
+from firebase import db
+
+# Other modules import
+import re
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from message_codec import new_message_id
+from prewarm import STUDY_TIMEZONE
+
+DIET_KEYWORDS = {'今日飲食規劃': 'plan', '今日飲食記錄': 'record'}
+DIET_DAYS_COLLECTION = 'diet_days'
+# Latest day with a plan / record, denormalized on the user document for the adherence query
+ADHERENCE_FIELDS = {'plan': 'last_plan_date', 'record': 'last_record_date'}
+KEYWORD_DATE = re.compile(r' - (\d{4})/(\d{2})/(\d{2})')
+
+
+def diet_context(user_message, current_context, today):
+    # Which day's plan or record a user message belongs to: the keyword starts one,
+    # follow-up messages on the same day stay in it. `today` is YYYY-MM-DD.
+    for keyword, kind in DIET_KEYWORDS.items():
+        if user_message.startswith(keyword):
+            match = KEYWORD_DATE.match(user_message[len(keyword):])
+            date = '-'.join(match.groups()) if match else today
+            return {'kind': kind, 'date': date}
+    if current_context and current_context.get('date') == today:
+        return current_context
+    return None
+
+def adherence_fields(context, current):
+    # Both fields are always written ('' = never), so every user matches the range queries on them
+    fields = {field: current.get(field) or '' for field in ADHERENCE_FIELDS.values()}
+    if context:
+        field = ADHERENCE_FIELDS[context['kind']]
+        fields[field] = max(fields[field], context['date'])
+    return fields
+
+def diet_entry(message, kind):
+    # Link to one message of the `messages` array by its ID; the user's own text is kept, replies are linked only
+    entry = {'id': message['id'], 'kind': kind, 'role': message['role'], 'create_at': message['create_at']}
+    if message['role'] == 'user':
+        entry['content'] = message['content']
+    return entry
+
+def day_reference(collection, user_id, date):
+    return db.collection(collection).document(user_id).collection(DIET_DAYS_COLLECTION).document(date)
+
+def day_updates(date, entries):
+    updates = {'date': date, 'updated_at': firestore.SERVER_TIMESTAMP}
+    for field in ('plans', 'records', 'replies'):
+        linked = [entry for entry in entries if entry_field(entry) == field]
+        if linked:
+            updates[field] = firestore.ArrayUnion(linked)
+    return updates
+
+def entry_field(entry):
+    if entry['role'] != 'user':
+        return 'replies'
+    return 'plans' if entry['kind'] == 'plan' else 'records'
+
+def index_messages(collection, user_id, context, messages, deadline=None):
+    # Link the messages of one turn to their day, one write per turn
+    if not context or not messages:
+        return
+    entries = [diet_entry(message, context['kind']) for message in messages]
+    timeout = deadline.timeout('firestore.diet_index', reserve=0) if deadline else None
+    day_reference(collection, user_id, context['date']).set(
+        day_updates(context['date'], entries), merge=True, timeout=timeout
+    )
+
+def study_date(create_at):
+    # Study day (YYYY-MM-DD) of a stored create_at, which is server time: UTC on Cloud Functions
+    try:
+        stored = datetime.strptime(create_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return create_at[:10]
+    return stored.astimezone(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d")
+
+def build_index(messages):
+    # Day -> entries for a whole message history, used to backfill existing users.
+    # Messages stored before they had IDs get one here; the caller writes them back.
+    days = {}
+    context = None
+    for message in messages:
+        if not message.get('id'):
+            message['id'] = new_message_id()
+        today = study_date(message.get('create_at', ''))
+        if message['role'] == 'user':
+            context = diet_context(message.get('content', ''), context, today)
+        if context:
+            days.setdefault(context['date'], []).append(diet_entry(message, context['kind']))
+    return days
+
+def get_diet_days(collection, user_id, start_date, end_date):
+    # Plans, records and reply links per day between two dates (YYYY-MM-DD, inclusive): one read per day
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    days = (datetime.strptime(end_date, "%Y-%m-%d") - start).days + 1
+    references = [day_reference(collection, user_id, (start + timedelta(days=i)).strftime("%Y-%m-%d")) for i in range(days)]
+    return {
+        snapshot.id: snapshot.to_dict()
+        for snapshot in db.get_all(references)
+        if snapshot.exists
+    }
+
+def week_range(phase_start, week):
+    # First and last day of a study week, e.g. week_range('2026-05-01', 3) for week 3 of a phase
+    start = datetime.strptime(phase_start, "%Y-%m-%d") + timedelta(weeks=week - 1)
+    return start.strftime("%Y-%m-%d"), (start + timedelta(days=6)).strftime("%Y-%m-%d")
@@ -19,9 +19,13 @@ cred = credentials.Certificate({
     "universe_domain": os.getenv('GOOGLE_FIREBASE_CREDENTIALS_UNIVERSE_DOMAIN')
 })
 
+# Realtime Database requests (the pause list) give up after this many seconds instead of the SDK's 120
+REALTIME_DB_TIMEOUT_SECONDS = float(os.getenv('REALTIME_DB_TIMEOUT_SECONDS', '5'))
+
 # 初始化 firebase app
 initialize_app(cred, {
-    'databaseURL': os.getenv('GOOGLE_FIREBASE_DATABASE_URL')
+    'databaseURL': os.getenv('GOOGLE_FIREBASE_DATABASE_URL'),
+    'httpTimeout': REALTIME_DB_TIMEOUT_SECONDS
 })
 db = firestore.client()
 realtime_db = realtime
\ No newline at end of file
@@ -0,0 +1,207 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Other modules import
+import csv
+import re
+from array import array
+
+# Load environment variables
+load_dotenv()
+
+# 'context' attaches the estimate to the Assistant message, 'off' disables the lookup
+FOOD_LOOKUP_MODE = os.getenv('FOOD_LOOKUP_MODE', 'context')
+FOOD_EXCHANGE_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'food_exchange.csv')
+
+# 國民健康署食物代換表：每一份所含的醣類（公克）
+CATEGORY_CARB_GRAMS = {
+    '全穀雜糧類': 15,
+    '水果類': 15,
+    '乳品類': 12,
+    '蔬菜類': 5,
+    '豆魚蛋肉類': 0,
+    '油脂與堅果種子類': 0,
+}
+# 1 醣類份 = 15 公克醣類
+CARB_GRAMS_PER_EXCHANGE = 15
+
+CHINESE_NUMERALS = {'半': 0.5, '一': 1, '兩': 2, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+UNITS = '碗|盤|片|顆|個|杯|條|根|份|湯匙|匙|塊|瓶|盒'
+# Units written interchangeably; any other unit differing from the item's (一盤 of a 碗 item, 一瓶 of a 杯 item) is not converted
+SAME_UNITS = {'個': '顆', '湯匙': '匙'}
+NUMBER = r'\d+(?:\.\d+)?(?:/\d+)?|[一二兩三四五六七八九十]?半|十?[一二兩三四五六七八九]|十'
+# e.g. "一碗半", "1.5碗", "半顆"
+QUANTITY_AFTER = re.compile(rf'\s*({NUMBER})\s*({UNITS})(半)?')
+QUANTITY_BEFORE = re.compile(rf'({NUMBER})\s*({UNITS})(半)?的?$')
+
+
+def parse_quantity(text):
+    if '/' in text:
+        numerator, denominator = text.split('/')
+        return float(numerator) / float(denominator) if float(denominator) else 0.0
+    if re.match(r'^\d', text):
+        return float(text)
+    value = 0.0
+    # 一半 is a half, not one and a half
+    if text in ('半', '一半'):
+        return 0.5
+    if text.endswith('半'):
+        value, text = 0.5, text[:-1]
+    if text.startswith('十'):
+        value, text = value + 10, text[1:]
+    elif len(text) == 2 and text[1] == '十':
+        value, text = value + CHINESE_NUMERALS[text[0]] * 10, ''
+    if text:
+        value += CHINESE_NUMERALS[text]
+    return value
+
+def same_unit(written, unit):
+    return SAME_UNITS.get(written, written) == SAME_UNITS.get(unit, unit)
+
+def bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FoodExchangeTable:
+    # In-process food database, indexed once per instance
+    def __init__(self, path=FOOD_EXCHANGE_TABLE):
+        self.names = []       # canonical food name per item
+        self.categories = []  # 六大類 category per item
+        self.units = []       # serving unit per item
+        self.unit_exchanges = array('d')  # 份 of the category per unit
+        self.unit_carbs = array('d')      # grams of carbohydrate per unit
+        self.term_item = []   # item index per searchable term (name or alias)
+        self.terms = []
+        self.term_bigram_count = array('H')
+        self.bigram_index = {}  # Traditional Chinese bigram -> term indexes
+
+        with open(path, encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                item = len(self.names)
+                self.names.append(row['name'])
+                self.categories.append(row['category'])
+                self.units.append(row['unit'])
+                exchanges = float(row['unit_exchanges'])
+                self.unit_exchanges.append(exchanges)
+                self.unit_carbs.append(exchanges * CATEGORY_CARB_GRAMS[row['category']])
+                aliases = [alias for alias in row['aliases'].split('|') if alias]
+                for term in [row['name']] + aliases:
+                    # Single characters are too ambiguous in free text (e.g. 晚飯, 蛋糕)
+                    if len(term) < 2:
+                        continue
+                    self._add_term(term, item)
+
+    def _add_term(self, term, item):
+        term_id = len(self.terms)
+        self.terms.append(term)
+        self.term_item.append(item)
+        term_bigrams = bigrams(term)
+        self.term_bigram_count.append(len(term_bigrams))
+        for bigram in term_bigrams:
+            self.bigram_index.setdefault(bigram, []).append(term_id)
+
+    def match_terms(self, text):
+        # Candidate terms are those whose every bigram appears in the text
+        hits = {}
+        for bigram in bigrams(text):
+            for term_id in self.bigram_index.get(bigram, ()):
+                hits[term_id] = hits.get(term_id, 0) + 1
+        matches = []
+        for term_id, count in hits.items():
+            if count < self.term_bigram_count[term_id]:
+                continue
+            term = self.terms[term_id]
+            start = text.find(term)
+            while start != -1:
+                matches.append((start, start + len(term), term_id))
+                start = text.find(term, start + 1)
+
+        # Keep the longest non-overlapping matches (糙米飯 over 米飯)
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        end = -1
+        for match in matches:
+            if match[0] >= end:
+                selected.append(match)
+                end = match[1]
+        return selected
+
+    def extract_items(self, text):
+        # (item, quantity in the item's unit, unit written) from a meal log, e.g. "早餐：一碗白飯、蘋果半顆".
+        # Quantity is None when the unit written is not the item's (白飯一盤): it is not guessed.
+        items = []
+        for start, end, term_id in self.match_terms(text):
+            item = self.term_item[term_id]
+            quantity, written = 1.0, self.units[item]
+            # The quantity after the name belongs to the next food in "一碗白飯一顆蘋果", so prefer one in the item's unit
+            candidates = [found for found in (QUANTITY_AFTER.match(text, end),
+                                              QUANTITY_BEFORE.search(text[max(0, start - 7):start])) if found]
+            candidates.sort(key=lambda found: not same_unit(found.group(2), self.units[item]))
+            if candidates:
+                found = candidates[0]
+                written = found.group(2)
+                quantity = parse_quantity(found.group(1)) + (0.5 if found.group(3) else 0)
+                if not same_unit(written, self.units[item]):
+                    quantity = None
+            items.append((item, quantity, written))
+        return items
+
+    def estimate(self, text):
+        items = self.extract_items(text)
+        if not items:
+            return None
+        entries = []
+        total_carbs = 0.0
+        for i, q, written in items:
+            entry = {'name': self.names[i], 'category': self.categories[i], 'quantity': q, 'unit': self.units[i]}
+            if q is None:
+                # Listed without an estimate and left out of the total
+                entry.update(unit=written, exchanges=None, carb_g=None)
+            else:
+                carb = self.unit_carbs[i] * q
+                total_carbs += carb
+                entry.update(exchanges=round(self.unit_exchanges[i] * q, 1), carb_g=round(carb, 1))
+            entries.append(entry)
+        return {
+            'items': entries,
+            'carb_g': round(total_carbs, 1),
+            'carb_exchanges': round(total_carbs / CARB_GRAMS_PER_EXCHANGE, 1)
+        }
+
+
+def format_estimate(estimate):
+    lines = ['[醣類份數估算（依國民健康署食物代換表，僅供參考）]']
+    for item in estimate['items']:
+        if item['quantity'] is None:
+            lines.append(f"{item['name']}（以「{item['unit']}」計）：{item['category']}，份量無法換算，未計入合計")
+            continue
+        quantity = f"{item['quantity']:g}"
+        lines.append(
+            f"{item['name']} {quantity}{item['unit']}：{item['category']} {item['exchanges']:g} 份，醣類約 {item['carb_g']:g} 公克"
+        )
+    lines.append(f"合計醣類約 {estimate['carb_g']:g} 公克（約 {estimate['carb_exchanges']:g} 份醣類）")
+    return "\n".join(lines)
+
+def is_diet_record(message):
+    return message.startswith("今日飲食記錄")
+
+
+_table = None
+
+def get_table():
+    # Built lazily on first use, then shared by every request on this instance
+    global _table
+    if _table is None:
+        _table = FoodExchangeTable()
+    return _table
+
+def estimate_message(message, diet_kind=None):
+    # Meal logs are the 今日飲食記錄 message itself or follow-ups while a record is open
+    if FOOD_LOOKUP_MODE == 'off' or not (is_diet_record(message) or diet_kind == 'record'):
+        return None
+    try:
+        return get_table().estimate(message)
+    except Exception as e:
+        print(f"Error estimating food exchanges: {e}")
+        return None
@@ -0,0 +1,542 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+import traceback
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# LineBot import
+from linebot import LineBotApi, WebhookHandler
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import (MessageEvent, TextMessage, ImageMessage, TextSendMessage, PostbackEvent)
+
+# Firebase import
+from firebase_functions import https_fn
+from firebase_admin import firestore
+from firebase import db
+
+# Other modules import
+import re
+import json
+import hmac
+import base64
+import hashlib
+import time
+from capture import capture_webhook
+from deadline import DeadlineExceeded, current_deadline, start_deadline
+from linebot_content import knowledge_menu, postback_messages
+from assistant import MIN_RUN_SECONDS, add_image_to_thread, add_message_to_thread, run_assistant, remove_markdown
+from food_exchange import estimate_message, format_estimate
+from usage import record_run_usage
+from thread_pool import acquire_thread
+from retry import call_with_retry
+from diet_index import adherence_fields, diet_context, index_messages
+from photos import PHOTO_ATTACH, load_thumbnail, store_photo
+from message_codec import new_message
+from memprofile import profile_request
+from prewarm import STUDY_TIMEZONE, cached_profile, log_reply_latency, note_request, pause_list
+
+# Load environment variables
+load_dotenv()
+
+DEFERRED_MESSAGE = "糖安心小幫手已經收到您的訊息囉！正在努力為您解答中"
+PAUSED_MESSAGE = "您好！糖安心小幫手目前休息中，會盡快回覆您的訊息～"
+PHOTO_RECEIVED_MESSAGE = "已收到您的照片囉！"
+# Content of a photo in the message history, next to its 'photo' reference
+PHOTO_PLACEHOLDER = "[照片]"
+# User document fields a turn needs; `messages` is only ever appended to, never read
+TURN_FIELDS = ['thread_id', 'is_processing', 'pending_messages', 'deferred_messages',
+               'diet_context', 'last_plan_date', 'last_record_date']
+
+
+class BotArm:
+    # Configuration of one study arm served by the shared bot engine
+    def __init__(self, name, channel_access_token_env, channel_secret_env, collection,
+                 assistant_enabled, pause_list_enabled, error_message, destination_env=None):
+        self.name = name
+        self.channel_access_token_env = channel_access_token_env
+        self.channel_secret_env = channel_secret_env
+        self.collection = collection
+        self.assistant_enabled = assistant_enabled
+        self.pause_list_enabled = pause_list_enabled
+        self.error_message = error_message
+        # Bot user ID LINE sends as "destination" in the webhook body
+        self.destination_env = destination_env
+
+
+class LinebotEngine:
+    def __init__(self, arm):
+        self.arm = arm
+
+        # LineBot Initialization
+        channel_access_token = os.getenv(arm.channel_access_token_env)
+        channel_secret = os.getenv(arm.channel_secret_env)
+
+        if not channel_access_token or not channel_secret:
+            raise ValueError(
+                "LINE Bot credentials are not properly configured. "
+                f"Please check {arm.channel_access_token_env} and {arm.channel_secret_env} in your .env file."
+            )
+
+        self.channel_secret = channel_secret
+        self.destination = os.getenv(arm.destination_env) if arm.destination_env else None
+        self.line_bot_api = LineBotApi(channel_access_token)
+        self.handler = WebhookHandler(channel_secret)
+
+        # The SDK counts `self` of bound methods as an argument, so register plain functions
+        @self.handler.add(MessageEvent, message=TextMessage)
+        def handle_message(event):
+            self.handle_message(event)
+
+        @self.handler.add(MessageEvent, message=ImageMessage)
+        def handle_image(event):
+            self.handle_image(event)
+
+        @self.handler.add(PostbackEvent)
+        def handle_postback(event):
+            self.handle_postback(event)
+
+    def matches(self, body, signature):
+        # Whether a webhook was sent to this arm's channel
+        if self.destination:
+            try:
+                return json.loads(body).get('destination') == self.destination
+            except ValueError:
+                return False
+        return self.signed(body, signature)
+
+    def signed(self, body, signature):
+        digest = hmac.new(self.channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+        return hmac.compare_digest(base64.b64encode(digest).decode('utf-8'), signature)
+
+    # Main Firebase Function handler
+    def handle_request(self, req: https_fn.Request) -> https_fn.Response:
+        # Start the request budget as soon as the webhook arrives
+        start_deadline()
+        received_at = time.time()
+        note_request()
+
+        # Verify signature
+        signature = req.headers.get('X-Line-Signature', '')
+        body = req.data.decode('utf-8')
+        # Only webhooks LINE signed are captured, never arbitrary posts to the public URL
+        if self.signed(body, signature):
+            capture_webhook(self.arm.name, body, received_at)
+
+        try:
+            with profile_request(self.arm.name):
+                self.handler.handle(body, signature)
+        except InvalidSignatureError:
+            print(traceback.format_exc())
+            print("Invalid signature. Please check your channel access token and secret.")
+            return https_fn.Response(response="Invalid signature", status=400)
+        except Exception as e:
+            print(traceback.format_exc())
+            print(f"An error occurred: {e}")
+            return https_fn.Response(response="Internal error", status=500)
+
+        return https_fn.Response(response="OK", status=200)
+
+    def reply(self, event, messages, deadline):
+        self.line_bot_api.reply_message(
+            event.reply_token,
+            messages,
+            timeout=deadline.timeout('reply_message', reserve=0)
+        )
+        log_reply_latency(self.arm.name, deadline)
+
+    # Handle user message
+    def handle_message(self, event):
+        deadline = current_deadline()
+        user_id = event.source.user_id
+        profile = cached_profile(self.line_bot_api, user_id, deadline)
+        display_name = profile.display_name
+        user_message = event.message.text
+        print(event.message)
+
+        if self.paused(event, display_name, deadline):
+            return
+
+        # If user message contains "聯繫研究人員" or "糖安心介紹", just return
+        if user_message == "聯繫研究人員" or user_message == "糖安心介紹":
+            return
+
+        # 處理「飲食小知識專區」關鍵字
+        elif user_message == "飲食小知識專區":
+            self.reply(event, knowledge_menu(), deadline)
+            return
+
+        # If user message is a Line emoji, return nothing
+        if hasattr(event.message, 'emojis') and event.message.emojis and re.match(r'^\(.*\)$', user_message):
+            print(f"Received emoji-only message: {user_message}")
+            return
+
+        if self.arm.assistant_enabled:
+            self.assistant_turn(event, user_id, profile, user_message, deadline)
+        else:
+            self.record_turn(event, user_id, profile, user_message, deadline)
+
+    def paused(self, event, display_name, deadline):
+        # Participants on the pause list get the pause message instead of an answer
+        if not self.arm.pause_list_enabled:
+            return False
+        names, message = pause_list(deadline)
+        if display_name in names:
+            self.reply(event, TextSendMessage(text=message or PAUSED_MESSAGE), deadline)
+            return True
+        return False
+
+    # Handle meal photo
+    def handle_image(self, event):
+        deadline = current_deadline()
+        user_id = event.source.user_id
+        profile = cached_profile(self.line_bot_api, user_id, deadline)
+        if self.paused(event, profile.display_name, deadline):
+            return
+        try:
+            photo, thumbnail = store_photo(self.line_bot_api, self.arm.collection, user_id, event.message.id, deadline)
+        except Exception as e:
+            self.handle_error(event, e, None, deadline)
+            return
+        self.photo_turn(event, user_id, profile, photo, thumbnail, deadline)
+
+    def photo_turn(self, event, user_id, profile, photo, thumbnail, deadline):
+        # Photos are recorded without an Assistant run (and acknowledged on the Assistant arm); the thread sees them on the next turn
+        entry = new_message('user', PHOTO_PLACEHOLDER, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), photo=photo)
+        try:
+            user_ref = db.collection(self.arm.collection).document(user_id)
+            user_doc = call_with_retry('firestore', lambda: user_ref.get(
+                field_paths=['thread_id', 'is_processing'], retry=None, timeout=deadline.timeout('firestore.get_user')
+            ), deadline)
+            if user_doc.exists:
+                user_data = user_doc.to_dict()
+            else:
+                user_data = self.new_user(profile)
+                if self.arm.assistant_enabled:
+                    user_data.update(thread_id=acquire_thread(deadline), is_processing=False,
+                                     pending_messages=[], deferred_messages=[])
+                call_with_retry('firestore', lambda: user_ref.set(user_data, retry=None, timeout=deadline.timeout('firestore.create_user')), deadline)
+
+            if user_data.get('is_processing'):
+                # The running turn moves it into `messages` (and the thread) once its run is done
+                call_with_retry('firestore', lambda: user_ref.update({
+                    'pending_messages': firestore.ArrayUnion([entry]),
+                    'last_active': firestore.SERVER_TIMESTAMP
+                }, retry=None, timeout=deadline.timeout('firestore.update_pending')), deadline)
+            else:
+                if self.arm.assistant_enabled:
+                    entry['in_thread'] = self.attach_photo(user_data.get('thread_id'), photo, thumbnail, deadline)
+                call_with_retry('firestore', lambda: user_ref.update({
+                    'messages': firestore.ArrayUnion([entry]),
+                    'last_active': firestore.SERVER_TIMESTAMP
+                }, retry=None, timeout=deadline.timeout('firestore.save_photo')), deadline)
+            # Like its text messages, the control arm records photos without replying
+            if self.arm.assistant_enabled:
+                self.reply(event, TextSendMessage(text=PHOTO_RECEIVED_MESSAGE), deadline)
+        except Exception as e:
+            self.handle_error(event, e, locals().get('user_ref'), deadline)
+
+    def attach_photo(self, thread_id, photo, thumbnail, deadline):
+        # Whether the photo reached the Assistant thread; failures only cost the Assistant this photo
+        if PHOTO_ATTACH != 'thread' or not thread_id or not photo.get('thumbnail'):
+            return False
+        try:
+            add_image_to_thread(thread_id, thumbnail or load_thumbnail(photo), deadline)
+            return True
+        except Exception as e:
+            print(f"Error attaching photo {photo['message_id']} to thread: {e}")
+            return False
+
+    def new_user(self, profile):
+        return {
+            'last_active': firestore.SERVER_TIMESTAMP,
+            'create_at': firestore.SERVER_TIMESTAMP,
+            'user_info': {
+                'display_name': profile.display_name,
+                'language': profile.language if hasattr(profile, 'language') else 'zh-Hant'
+            },
+            'messages': [],
+            'last_plan_date': '',
+            'last_record_date': '',
+        }
+
+    def record_turn(self, event, user_id, profile, user_message, deadline):
+        # Arms without the Assistant only keep the message history
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        today = datetime.now(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d")
+        try:
+            user_ref = db.collection(self.arm.collection).document(user_id)
+            user_doc = call_with_retry('firestore', lambda: user_ref.get(
+                field_paths=TURN_FIELDS, retry=None, timeout=deadline.timeout('firestore.get_user')
+            ), deadline)
+
+            # Messages stored by this request
+            messages = []
+            context = None
+            user_data = {}
+
+            if user_doc.exists:
+                user_data = user_doc.to_dict()
+                context = user_data.get('diet_context')
+            else:
+                call_with_retry('firestore', lambda: user_ref.set(self.new_user(profile), retry=None, timeout=deadline.timeout('firestore.create_user')), deadline)
+
+            # Immediately update Firestore with user message
+            context = diet_context(user_message, context, today)
+            messages.append(new_message('user', user_message, current_time))
+            call_with_retry('firestore', lambda: user_ref.update({
+                'messages': firestore.ArrayUnion(messages),
+                'diet_context': context,
+                **adherence_fields(context, user_data),
+                'last_active': firestore.SERVER_TIMESTAMP
+            }, retry=None, timeout=deadline.timeout('firestore.save_user_message', reserve=0)), deadline)
+            self.index_diet(user_id, [(context, messages[-1])], deadline)
+
+        except Exception as e:
+            self.handle_error(event, e, locals().get('user_ref'), deadline)
+
+    def assistant_turn(self, event, user_id, profile, user_message, deadline):
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Study days follow the participants' clock: the 07:00 plan reminder is still the previous day in UTC
+        study_now = datetime.now(ZoneInfo(STUDY_TIMEZONE))
+        current_date = study_now.strftime("%Y/%m/%d")
+        today = study_now.strftime("%Y-%m-%d")
+
+        # Check if user message is "今日飲食規劃" or "今日飲食記錄"
+        if user_message == "今日飲食規劃":
+            user_message = f"今日飲食規劃 - {current_date}"
+        elif user_message == "今日飲食記錄":
+            user_message = f"今日飲食記錄 - {current_date}"
+
+        # Messages whose Assistant reply is still owed, persisted if the budget runs out
+        deferred = [{'content': user_message, 'in_thread': False, 'create_at': current_time}]
+        assistant_reply = None
+        locked = False
+        # Usage of every Assistant run in this request, for the usage ledger
+        runs = []
+        # (diet context, message) of every message stored in this request, for the diet index
+        diet_links = []
+        try:
+            user_ref = db.collection(self.arm.collection).document(user_id)
+            user_doc = call_with_retry('firestore', lambda: user_ref.get(
+                field_paths=TURN_FIELDS, retry=None, timeout=deadline.timeout('firestore.get_user')
+            ), deadline)
+
+            # Messages stored by this request; every write appends them again, which ArrayUnion makes a no-op
+            messages = []
+            is_processing = False
+            deferred_messages = []
+            context = None
+            adherence = {}
+
+            if user_doc.exists:
+                # If user exists, get thread_id and update messages
+                user_data = user_doc.to_dict()
+                thread_id = user_data.get('thread_id')
+                is_processing = user_data.get('is_processing', False)
+                pending_messages = user_data.get('pending_messages', [])
+                deferred_messages = user_data.get('deferred_messages', [])
+                context = user_data.get('diet_context')
+                adherence = adherence_fields(None, user_data)
+
+                if is_processing:
+                    pending_messages.append({
+                        'role': 'user',
+                        'content': user_message,
+                        'create_at': current_time
+                    })
+                    call_with_retry('firestore', lambda: user_ref.update({
+                        'pending_messages': pending_messages,
+                        'last_active': firestore.SERVER_TIMESTAMP
+                    }, retry=None, timeout=deadline.timeout('firestore.update_pending')), deadline)
+                    print("Pending message added")
+                    return
+            else:
+                # If user does not exist, take a pre-created thread
+                thread_id = acquire_thread(deadline)
+                call_with_retry('firestore', lambda: user_ref.set(dict(
+                    self.new_user(profile),
+                    thread_id=thread_id,
+                    is_processing=False,
+                    pending_messages=[],
+                    deferred_messages=[]
+                ), retry=None, timeout=deadline.timeout('firestore.create_user')), deadline)
+
+            # Update user message status
+            call_with_retry('firestore', lambda: user_ref.update({
+                'is_processing': True,
+                'last_active': firestore.SERVER_TIMESTAMP,
+            }, retry=None, timeout=deadline.timeout('firestore.lock')), deadline)
+            locked = True
+
+            # Immediately update Firestore with user message
+            context = diet_context(user_message, context, today)
+            adherence = adherence_fields(context, adherence)
+            messages.append(new_message('user', user_message, current_time))
+            diet_links.append((context, messages[-1]))
+            call_with_retry('firestore', lambda: user_ref.update({
+                'messages': firestore.ArrayUnion(messages),
+                'diet_context': context,
+                **adherence,
+                'last_active': firestore.SERVER_TIMESTAMP
+            }, retry=None, timeout=deadline.timeout('firestore.save_user_message')), deadline)
+
+            # Replay messages an earlier request had to defer, then send user message to Assistant
+            thread_message = "\n".join(
+                [msg['content'] for msg in deferred_messages if not msg.get('in_thread')] + [user_message]
+            )
+            # Attach the local carbohydrate estimate of a meal log so the Assistant does less work
+            estimate = estimate_message(user_message, context['kind'] if context else None)
+            if estimate:
+                thread_message = f"{thread_message}\n\n{format_estimate(estimate)}"
+            deferred = [msg for msg in deferred_messages if msg.get('in_thread')]
+            deferred.append({'content': thread_message, 'in_thread': False, 'create_at': current_time})
+            add_message_to_thread(thread_id, thread_message, deadline)
+            deferred = [dict(msg, in_thread=True) for msg in deferred]
+            assistant_reply = run_assistant(thread_id, deadline, runs)
+            assistant_reply = remove_markdown(assistant_reply)
+            deferred = []
+
+            # Add assistant reply
+            messages.append(new_message('assistant', assistant_reply, current_time))
+            diet_links.append((context, messages[-1]))
+
+            pending_messages = call_with_retry('firestore', lambda: user_ref.get(
+                field_paths=['pending_messages'], retry=None, timeout=deadline.timeout('firestore.get_pending')
+            ), deadline).to_dict().get('pending_messages', [])
+            # Photos sent during the run only move into the history (and the thread)
+            for msg in pending_messages:
+                if msg.get('photo'):
+                    msg['in_thread'] = self.attach_photo(thread_id, msg['photo'], None, deadline)
+                    messages.append(msg)
+            pending_messages = [msg for msg in pending_messages if not msg.get('photo')]
+            if pending_messages:
+                combined_message = "\n".join([msg['content'] for msg in pending_messages])
+                deferred = [{'content': combined_message, 'in_thread': False, 'create_at': current_time}]
+                context = diet_context(combined_message, context, today)
+                adherence = adherence_fields(context, adherence)
+                messages.append(new_message('user', combined_message, current_time))
+                diet_links.append((context, messages[-1]))
+                pending_messages = []
+                if not deadline.has_budget(MIN_RUN_SECONDS):
+                    # Not enough budget for a second run: keep them for the next request
+                    print(f"Deferring pending messages: {deadline.remaining():.1f}s left")
+                else:
+                    add_message_to_thread(thread_id, combined_message, deadline)
+                    deferred = [dict(msg, in_thread=True) for msg in deferred]
+                    assistant_reply = run_assistant(thread_id, deadline, runs)
+                    assistant_reply = remove_markdown(assistant_reply)
+                    deferred = []
+                    messages.append(new_message('assistant', assistant_reply, current_time))
+                    diet_links.append((context, messages[-1]))
+
+            # Update with new message
+            call_with_retry('firestore', lambda: user_ref.update({
+                'messages': firestore.ArrayUnion(messages),
+                'pending_messages': pending_messages,
+                'deferred_messages': deferred,
+                'diet_context': context,
+                **adherence,
+                'last_active': firestore.SERVER_TIMESTAMP,
+                'is_processing': False
+            }, retry=None, timeout=deadline.timeout('firestore.save_reply', reserve=0)), deadline)
+
+            self.reply(event, TextSendMessage(text=assistant_reply), deadline)
+            self.index_diet(user_id, diet_links, deadline)
+            self.record_usage(user_id, runs, deadline)
+        except DeadlineExceeded as e:
+            # Stop cleanly: release the lock, keep what still needs an answer and reply with what we have
+            print(f"Deadline exceeded for user {user_id} at stage '{e.stage}' "
+                  f"after {deadline.elapsed():.1f}s, deferring {len(deferred)} messages")
+            # Only the request holding the processing lock may release it
+            if locked:
+                try:
+                    user_ref.update({
+                        'messages': firestore.ArrayUnion(messages),
+                        'deferred_messages': deferred,
+                        'diet_context': context,
+                        **adherence,
+                        'deferred_reason': {
+                            'stage': e.stage,
+                            'elapsed': round(deadline.elapsed(), 2),
+                            'create_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        },
+                        'last_active': firestore.SERVER_TIMESTAMP,
+                        'is_processing': False
+                    }, retry=None, timeout=deadline.timeout('firestore.save_deferred', reserve=0))
+                    self.index_diet(user_id, diet_links, deadline)
+                except Exception as e:
+                    print(f"Error saving deferred messages: {e}")
+            try:
+                self.reply(event, TextSendMessage(text=assistant_reply or DEFERRED_MESSAGE), deadline)
+            except Exception as e:
+                print(f"Error replying after deadline: {e}")
+            self.record_usage(user_id, runs, deadline)
+        except Exception as e:
+            self.handle_error(event, e, locals().get('user_ref'), deadline, locked)
+            self.record_usage(user_id, runs, deadline)
+
+    def index_diet(self, user_id, links, deadline):
+        # Per-day index of plans, records and replies; a failure is logged, the diet_index backfill rebuilds it
+        try:
+            group = []
+            for context, message in links + [(None, None)]:
+                if group and context != group[0][0]:
+                    index_messages(self.arm.collection, user_id, group[0][0], [item for _, item in group], deadline)
+                    group = []
+                if context:
+                    group.append((context, message))
+        except Exception as e:
+            print(f"Error indexing diet messages: {e}")
+
+    def record_usage(self, user_id, runs, deadline):
+        # Usage accounting must never cost the user a reply, so it runs last and only logs failures
+        try:
+            record_run_usage(self.arm.collection, user_id, runs, deadline)
+        except Exception as e:
+            print(f"Error recording run usage: {e}")
+
+    def handle_error(self, event, error, user_ref, deadline, locked=False):
+        print(traceback.format_exc())
+        print(f"An error occurred: {error}")
+        error_message = self.arm.error_message
+        # Save first: a failed or slow reply must not leave the processing lock held
+        if user_ref is not None:
+            try:
+                message = new_message('assistant', error_message, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                updates = {
+                    'messages': firestore.ArrayUnion([message]),
+                    'last_active': firestore.SERVER_TIMESTAMP
+                }
+                # Only the request holding the processing lock may release it
+                if locked:
+                    updates['is_processing'] = False
+                user_ref.update(updates, retry=None, timeout=deadline.timeout('firestore.save_error', reserve=0))
+            except Exception as e:
+                print(f"Error updating error message: {e}")
+        try:
+            self.reply(event, TextSendMessage(text=error_message), deadline)
+        except Exception as e:
+            print(f"Error replying with error message: {e}")
+
+    def handle_postback(self, event):
+        deadline = current_deadline()
+        data = event.postback.data
+
+        messages = postback_messages(data)
+        if messages is not None:
+            self.reply(event, messages, deadline)
+        # 如果不是特定的 postback 資料，可以記錄下來
+        else:
+            print(f"Received postback: {data}")
+
+
+def route_request(req: https_fn.Request, engines) -> https_fn.Response:
+    # Serve several channels from one function: pick the arm by destination, then by signature
+    signature = req.headers.get('X-Line-Signature', '')
+    body = req.data.decode('utf-8')
+    for engine in engines:
+        if engine.matches(body, signature):
+            return engine.handle_request(req)
+    print("No LINE channel matches this webhook. Please check the LINE_DESTINATION settings and channel secrets.")
+    return https_fn.Response(response="Invalid signature", status=400)
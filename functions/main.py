@@ -1,21 +1,58 @@
 # Environment import
+import os
 from dotenv import load_dotenv
 
 # Firebase import
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 
 # Linebot import
-from linebot_experiment import linebot_experiment_handler
-from linebot_control import linebot_control_handler
+from linebot_experiment import linebot_experiment_handler, engine as experiment_engine, experiment_arm
+from linebot_control import linebot_control_handler, engine as control_engine, control_arm
+from linebot_engine import route_request
+from adherence import adherence_handler
+from deadline import FUNCTION_TIMEOUT_SECONDS
+from prewarm import is_warm_request, send_warm_requests, warm_handler
+from thread_pool import refill_pool
 
 # Load environment variables
 load_dotenv()
 
+# 'legacy' also deploys the per-arm linebot and linebot_control functions the LINE webhook URLs
+# point at today; switch to 'router' (linebot_router alone) once both URLs are moved, see README
+WEBHOOK_FUNCTIONS = os.getenv('WEBHOOK_FUNCTIONS', 'legacy')
+
 # Main Firebase Function handler
-@https_fn.on_request(region="asia-east1")
-def linebot_control(req: https_fn.Request) -> https_fn.Response:
-    return linebot_control_handler(req)
+if WEBHOOK_FUNCTIONS == 'legacy':
+    @https_fn.on_request(region="asia-east1", timeout_sec=FUNCTION_TIMEOUT_SECONDS)
+    def linebot_control(req: https_fn.Request) -> https_fn.Response:
+        if is_warm_request(req):
+            return warm_handler(req, [control_engine])
+        return linebot_control_handler(req)
+
+    @https_fn.on_request(region="asia-east1", timeout_sec=FUNCTION_TIMEOUT_SECONDS)
+    def linebot(req: https_fn.Request) -> https_fn.Response:
+        if is_warm_request(req):
+            return warm_handler(req, [experiment_engine])
+        return linebot_experiment_handler(req)
 
+# Single entry point for both channels, so they share one warm instance pool
+@https_fn.on_request(region="asia-east1", timeout_sec=FUNCTION_TIMEOUT_SECONDS)
+def linebot_router(req: https_fn.Request) -> https_fn.Response:
+    if is_warm_request(req):
+        return warm_handler(req, [experiment_engine, control_engine])
+    return route_request(req, [experiment_engine, control_engine])
+
+# Read-only adherence query for the study staff
 @https_fn.on_request(region="asia-east1")
-def linebot(req: https_fn.Request) -> https_fn.Response:
-    return linebot_experiment_handler(req)
\ No newline at end of file
+def adherence(req: https_fn.Request) -> https_fn.Response:
+    return adherence_handler(req, [experiment_arm, control_arm])
+
+# Warm up instances five minutes before the 7:00 and 19:00 reminders
+@scheduler_fn.on_schedule(schedule="55 6,18 * * *", timezone=scheduler_fn.Timezone("Asia/Taipei"), region="asia-east1")
+def prewarm(event: scheduler_fn.ScheduledEvent) -> None:
+    send_warm_requests()
+
+# Keep pre-created Assistant threads ready for new participants; requests only claim from the pool
+@scheduler_fn.on_schedule(schedule="*/15 * * * *", timezone=scheduler_fn.Timezone("Asia/Taipei"), region="asia-east1")
+def refill_thread_pool(event: scheduler_fn.ScheduledEvent) -> None:
+    refill_pool()
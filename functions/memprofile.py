@@ -0,0 +1,82 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Other modules import
+import json
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Load environment variables
+load_dotenv()
+
+# 'off', 'rss' (resident set size only, cheap) or 'tracemalloc' (peak and top allocating lines, slow)
+MEMORY_PROFILE = os.getenv('MEMORY_PROFILE', 'off')
+# Share of requests sampled
+MEMORY_PROFILE_SAMPLE = float(os.getenv('MEMORY_PROFILE_SAMPLE', '1.0'))
+MEMORY_PROFILE_TOP = int(os.getenv('MEMORY_PROFILE_TOP', '8'))
+# Frames kept per allocation; more frames attribute SDK allocations to our calling line but cost more
+MEMORY_PROFILE_FRAMES = int(os.getenv('MEMORY_PROFILE_FRAMES', '1'))
+
+# tracemalloc is process-wide, so only one request at a time is traced; concurrent ones fall back to RSS
+_trace_lock = threading.Lock()
+
+
+def rss_kib():
+    # Current resident set size; ru_maxrss only ever grows, so read /proc where available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def top_allocations(snapshot, limit):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    return [
+        {'where': f"{stat.traceback[0].filename.rsplit('site-packages/', 1)[-1]}:{stat.traceback[0].lineno}",
+         'kib': round(stat.size / 1024, 1), 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:limit]
+    ]
+
+@contextmanager
+def profile_request(label):
+    # Logs one structured line per sampled request: RSS before/after and, with tracemalloc,
+    # the traced peak and the lines holding the most memory when the request ends
+    if MEMORY_PROFILE == 'off' or random.random() >= MEMORY_PROFILE_SAMPLE:
+        yield
+        return
+
+    traced = MEMORY_PROFILE == 'tracemalloc' and _trace_lock.acquire(blocking=False)
+    rss_before = rss_kib()
+    started = time.monotonic()
+    if traced:
+        tracemalloc.start(MEMORY_PROFILE_FRAMES)
+    try:
+        yield
+    finally:
+        entry = {
+            'severity': 'INFO',
+            'message': f"memory profile {label}",
+            'label': label,
+            'seconds': round(time.monotonic() - started, 3),
+            'rss_kib_before': rss_before,
+            'rss_kib_after': rss_kib(),
+            'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        if traced:
+            current, peak = tracemalloc.get_traced_memory()
+            entry.update(
+                traced_peak_kib=round(peak / 1024, 1),
+                traced_retained_kib=round(current / 1024, 1),
+                top_retained=top_allocations(tracemalloc.take_snapshot(), MEMORY_PROFILE_TOP),
+            )
+            tracemalloc.stop()
+            _trace_lock.release()
+        print(json.dumps(entry, ensure_ascii=False))
@@ -0,0 +1,135 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Other modules import
+import threading
+import time
+import uuid
+import zstandard
+
+# Load environment variables
+load_dotenv()
+
+# 'zstd' compresses long message content in Firestore, 'off' stores it plain (reading works either way)
+MESSAGE_COMPRESSION = os.getenv('MESSAGE_COMPRESSION', 'zstd')
+# Content shorter than this (UTF-8 bytes) stays plain: it would barely shrink and stays readable in the console
+MESSAGE_COMPRESSION_MIN_BYTES = int(os.getenv('MESSAGE_COMPRESSION_MIN_BYTES', '512'))
+MESSAGE_COMPRESSION_LEVEL = int(os.getenv('MESSAGE_COMPRESSION_LEVEL', '3'))
+# Dictionary new content is compressed with, trained by tools/train_message_dictionary.py; empty = none.
+# Earlier dictionaries must stay deployed as long as records compressed with them exist.
+MESSAGE_DICTIONARY_ID = os.getenv('MESSAGE_DICTIONARY_ID', '')
+MESSAGE_DICTIONARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'message_dictionaries')
+# Compressed content is stored under this field instead of 'content', with the dictionary ID under 'dict'
+COMPRESSED_FIELD = 'content_zstd'
+# Log the codec statistics every this many encoded messages
+STATS_EVERY = 200
+
+_dictionaries = {}
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {'encoded': 0, 'compressed': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'encode_seconds': 0.0,
+          'decoded': 0, 'decode_seconds': 0.0}
+
+
+def dictionary_path(dict_id):
+    return os.path.join(MESSAGE_DICTIONARY_DIR, f"{dict_id}.zdict")
+
+def load_dictionary(dict_id):
+    if dict_id not in _dictionaries:
+        with open(dictionary_path(dict_id), 'rb') as f:
+            _dictionaries[dict_id] = zstandard.ZstdCompressionDict(f.read())
+    return _dictionaries[dict_id]
+
+def _compressor():
+    # zstd contexts are not thread-safe, so each thread keeps its own
+    if not hasattr(_local, 'compressor'):
+        dictionary = load_dictionary(MESSAGE_DICTIONARY_ID) if MESSAGE_DICTIONARY_ID else None
+        _local.compressor = zstandard.ZstdCompressor(level=MESSAGE_COMPRESSION_LEVEL, dict_data=dictionary)
+    return _local.compressor
+
+def _decompressor(dict_id):
+    decompressors = _local.__dict__.setdefault('decompressors', {})
+    if dict_id not in decompressors:
+        dictionary = load_dictionary(dict_id) if dict_id else None
+        decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return decompressors[dict_id]
+
+def _record(**counts):
+    with _stats_lock:
+        for key, value in counts.items():
+            _stats[key] += value
+        report = counts.get('encoded') and _stats['encoded'] % STATS_EVERY == 0
+    if report:
+        print(f"Message codec: {codec_stats()}")
+
+def codec_stats():
+    # Compression ratio of the content this instance encoded and the time spent on both directions
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['ratio'] = round(stats['raw_bytes'] / stats['stored_bytes'], 2) if stats['stored_bytes'] else None
+    stats['encode_us'] = round(stats['encode_seconds'] / stats['encoded'] * 1e6, 1) if stats['encoded'] else None
+    stats['decode_us'] = round(stats['decode_seconds'] / stats['decoded'] * 1e6, 1) if stats['decoded'] else None
+    return stats
+
+def compress_text(text):
+    # (compressed bytes, dictionary ID) of a text; '' as ID means no dictionary
+    return _compressor().compress(text.encode('utf-8')), MESSAGE_DICTIONARY_ID
+
+def decompress_text(data, dict_id):
+    return _decompressor(dict_id).decompress(data).decode('utf-8')
+
+
+class StoredMessage(dict):
+    # A message as stored in Firestore. Its items are written back unchanged, so untouched
+    # messages are never re-encoded; 'content' is only decompressed when it is read.
+    def __getitem__(self, key):
+        if key == 'content' and COMPRESSED_FIELD in self:
+            if not hasattr(self, '_content'):
+                started = time.perf_counter()
+                self._content = decompress_text(dict.__getitem__(self, COMPRESSED_FIELD), self.get('dict', ''))
+                _record(decoded=1, decode_seconds=time.perf_counter() - started)
+            return self._content
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key == 'content' and COMPRESSED_FIELD in self:
+            return self['content']
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (key == 'content' and dict.__contains__(self, COMPRESSED_FIELD))
+
+
+def encode_message(message):
+    # Stored form of a new message: long content is compressed, everything else is kept as is
+    content = message.get('content')
+    if MESSAGE_COMPRESSION != 'zstd' or not isinstance(content, str):
+        return StoredMessage(message)
+    raw = content.encode('utf-8')
+    if len(raw) < MESSAGE_COMPRESSION_MIN_BYTES:
+        _record(encoded=1, raw_bytes=len(raw), stored_bytes=len(raw))
+        return StoredMessage(message)
+
+    started = time.perf_counter()
+    data, dict_id = compress_text(content)
+    elapsed = time.perf_counter() - started
+    if len(data) >= len(raw):
+        _record(encoded=1, raw_bytes=len(raw), stored_bytes=len(raw), encode_seconds=elapsed)
+        return StoredMessage(message)
+    _record(encoded=1, compressed=1, raw_bytes=len(raw), stored_bytes=len(data), encode_seconds=elapsed)
+    stored = StoredMessage({key: value for key, value in message.items() if key != 'content'})
+    dict.update(stored, {COMPRESSED_FIELD: data, 'dict': dict_id})
+    stored._content = content
+    return stored
+
+def new_message_id():
+    return uuid.uuid4().hex[:16]
+
+def new_message(role, content, create_at, **fields):
+    # The ID keeps equal messages (e.g. the same reply twice) distinct when they are appended with ArrayUnion
+    return encode_message(dict({'id': new_message_id(), 'role': role, 'content': content, 'create_at': create_at}, **fields))
+
+def decode_messages(messages):
+    # Wrap messages read from Firestore; plain (older or short) records read exactly as before
+    return [message if isinstance(message, StoredMessage) else StoredMessage(message) for message in messages]
@@ -0,0 +1,145 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Other modules import
+import hashlib
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from retry import call_with_retry
+
+# Load environment variables
+load_dotenv()
+
+# Where meal photos are kept: a Storage prefix ("gs://bucket/photos") or a local directory for local runs.
+# When empty only the LINE message ID is recorded.
+PHOTO_STORAGE = os.getenv('PHOTO_STORAGE', '')
+# Bytes read from LINE and written to storage at a time; Storage uploads need a multiple of 256 KiB
+PHOTO_CHUNK_BYTES = int(os.getenv('PHOTO_CHUNK_BYTES', str(256 * 1024)))
+PHOTO_THUMBNAIL_PIXELS = int(os.getenv('PHOTO_THUMBNAIL_PIXELS', '512'))
+PHOTO_THUMBNAIL_WORKERS = int(os.getenv('PHOTO_THUMBNAIL_WORKERS', '2'))
+# 'thread' also adds the thumbnail to the participant's Assistant thread (needs a model with image input)
+PHOTO_ATTACH = os.getenv('PHOTO_ATTACH', 'off')
+
+# Decoding is CPU bound and memory hungry, so few run at once however many photos arrive
+_thumbnail_pool = ThreadPoolExecutor(max_workers=PHOTO_THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+
+# Photo bytes received from LINE whose transfer to storage has not finished, over all requests
+_metrics_lock = threading.Lock()
+_in_flight = 0
+_peak_in_flight = 0
+
+
+def _track_in_flight(size):
+    global _in_flight, _peak_in_flight
+    with _metrics_lock:
+        _in_flight += size
+        _peak_in_flight = max(_peak_in_flight, _in_flight)
+        return _in_flight
+
+def _bucket_and_name(path):
+    bucket_name, _, name = path[len('gs://'):].partition('/')
+    return bucket_name, name
+
+def photo_path(collection, user_id, message_id, suffix=''):
+    return f"{PHOTO_STORAGE.rstrip('/')}/{collection}/{user_id}/{message_id}{suffix}.jpg"
+
+def open_writer(path, content_type, deadline):
+    if path.startswith('gs://'):
+        from firebase_admin import storage
+
+        bucket_name, name = _bucket_and_name(path)
+        # Resumable upload that holds at most one chunk in memory
+        return storage.bucket(bucket_name).blob(name).open(
+            'wb', chunk_size=PHOTO_CHUNK_BYTES, content_type=content_type,
+            timeout=deadline.timeout('storage.upload')
+        )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'wb')
+
+def open_reader(path):
+    if path.startswith('gs://'):
+        from firebase_admin import storage
+
+        bucket_name, name = _bucket_and_name(path)
+        return storage.bucket(bucket_name).blob(name).open('rb', chunk_size=PHOTO_CHUNK_BYTES)
+    return open(path, 'rb')
+
+def stream_content(line_bot_api, message_id, path, deadline):
+    # Copy the LINE content response to storage chunk by chunk, never holding the whole photo
+    content = call_with_retry('line', lambda: line_bot_api.get_message_content(
+        message_id, timeout=deadline.timeout('get_message_content')
+    ), deadline)
+    content_type = getattr(content, 'content_type', None) or 'image/jpeg'
+    digest = hashlib.sha256()
+    size = 0
+    chunks = 0
+    try:
+        with open_writer(path, content_type, deadline) as writer:
+            for chunk in content.iter_content(chunk_size=PHOTO_CHUNK_BYTES):
+                deadline.check('photo.stream')
+                _track_in_flight(len(chunk))
+                size += len(chunk)
+                chunks += 1
+                digest.update(chunk)
+                writer.write(chunk)
+    finally:
+        _track_in_flight(-size)
+    return {'content_type': content_type, 'bytes': size, 'chunks': chunks, 'sha256': digest.hexdigest()}
+
+def make_thumbnail(source_path, thumbnail_path):
+    from PIL import Image, ImageOps
+
+    with open_reader(source_path) as reader:
+        image = Image.open(reader)
+        # JPEG photos are decoded at a reduced scale straight away instead of at full size
+        image.draft('RGB', (PHOTO_THUMBNAIL_PIXELS, PHOTO_THUMBNAIL_PIXELS))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((PHOTO_THUMBNAIL_PIXELS, PHOTO_THUMBNAIL_PIXELS))
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='JPEG', quality=80)
+    thumbnail = buffer.getvalue()
+    if thumbnail_path.startswith('gs://'):
+        from firebase_admin import storage
+
+        bucket_name, name = _bucket_and_name(thumbnail_path)
+        storage.bucket(bucket_name).blob(name).upload_from_string(thumbnail, content_type='image/jpeg')
+    else:
+        with open(thumbnail_path, 'wb') as f:
+            f.write(thumbnail)
+    return thumbnail
+
+def load_thumbnail(photo):
+    with open_reader(photo['thumbnail']) as reader:
+        return reader.read()
+
+def store_photo(line_bot_api, collection, user_id, message_id, deadline):
+    # Returns the reference kept in the user's history and the thumbnail bytes (None when not made)
+    started = time.monotonic()
+    if not PHOTO_STORAGE:
+        print(f"PHOTO_STORAGE is not set, recording photo {message_id} without storing it")
+        return {'message_id': message_id}, None
+
+    path = photo_path(collection, user_id, message_id)
+    photo = dict(stream_content(line_bot_api, message_id, path, deadline), message_id=message_id, path=path)
+    stored = time.monotonic()
+
+    # A missing thumbnail never loses the photo, it can be made again from the original
+    thumbnail = None
+    try:
+        future = _thumbnail_pool.submit(make_thumbnail, path, photo_path(collection, user_id, message_id, '_thumb'))
+        thumbnail = future.result(timeout=deadline.timeout('photo.thumbnail', reserve=0))
+        photo['thumbnail'] = photo_path(collection, user_id, message_id, '_thumb')
+    except Exception as e:
+        print(f"Error making thumbnail of photo {message_id}: {type(e).__name__} {e}")
+    finished = time.monotonic()
+
+    with _metrics_lock:
+        in_flight, peak = _in_flight, _peak_in_flight
+    print(f"Stored photo {message_id}: {photo['bytes']} bytes in {photo['chunks']} chunks, "
+          f"stream {stored - started:.3f}s, thumbnail {finished - stored:.3f}s, "
+          f"bytes in flight {in_flight} (peak {peak})")
+    photo['latency'] = round(finished - started, 3)
+    return photo, thumbnail
@@ -0,0 +1,206 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# Firebase import
+from firebase_functions import https_fn
+from firebase_admin import firestore
+from firebase import db, realtime_db
+
+# Other modules import
+import hmac
+import json
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from deadline import Deadline
+from retry import call_with_retry
+
+# Load environment variables
+load_dotenv()
+
+# Shared secret of the warm-up requests (X-Warm-Token header); warm-up is off while it is unset
+WARM_TOKEN = os.getenv('WARM_TOKEN', '')
+# Function URLs the scheduled warm-up calls, comma separated (e.g. the linebot_router URL)
+WARM_URLS = [url.strip() for url in os.getenv('WARM_URLS', '').split(',') if url.strip()]
+# Concurrent warm-up requests per URL, i.e. how many instances to have ready
+WARM_INSTANCES = int(os.getenv('WARM_INSTANCES', '3'))
+WARM_SECONDS = 50
+# Participants active within this many days get their profiles preloaded
+ACTIVE_DAYS = int(os.getenv('ACTIVE_DAYS', '7'))
+PROFILE_WORKERS = 8
+
+# Staff changes to the pause list take effect after at most this long (WARM_PROFILE_SECONDS on pre-warmed instances)
+PAUSE_LIST_CACHE_SECONDS = int(os.getenv('PAUSE_LIST_CACHE_SECONDS', '60'))
+# The pause list is matched on display names, so profiles are cached no longer than the list itself
+PROFILE_CACHE_SECONDS = int(os.getenv('PROFILE_CACHE_SECONDS', str(PAUSE_LIST_CACHE_SECONDS)))
+
+STUDY_TIMEZONE = os.getenv('STUDY_TIMEZONE', 'Asia/Taipei')
+REMINDER_TIMES = os.getenv('REMINDER_TIMES', '07:00,19:00').split(',')
+# Replies this soon after a reminder are logged with their latency, at most REPLY_LOG_LIMIT per reminder and instance
+REMINDER_WINDOW_MINUTES = int(os.getenv('REMINDER_WINDOW_MINUTES', '30'))
+REPLY_LOG_LIMIT = 50
+# The pause list and profiles preloaded by the warm-up (5 minutes before a reminder) are kept until its window ends
+WARM_PROFILE_SECONDS = (5 + REMINDER_WINDOW_MINUTES) * 60
+
+_cache_lock = threading.Lock()
+_profiles = {}
+_pause_list = None
+# State of this instance, for telling cold from warm replies
+_instance = {'started': time.time(), 'requests': 0, 'warmed_at': None, 'logged': {}}
+# Number of the current request on this instance, 1 for the request that started it
+_request_number = ContextVar('request_number', default=0)
+
+
+# ====== In-process caches ======
+def cached_profile(line_bot_api, user_id, deadline, ttl=PROFILE_CACHE_SECONDS):
+    now = time.monotonic()
+    entry = _profiles.get(user_id)
+    if entry and entry[0] > now:
+        return entry[1]
+    profile = call_with_retry('line', lambda: line_bot_api.get_profile(user_id, timeout=deadline.timeout('get_profile')), deadline)
+    with _cache_lock:
+        _profiles[user_id] = (now + ttl, profile)
+    return profile
+
+def pause_list(deadline, ttl=PAUSE_LIST_CACHE_SECONDS):
+    # (display names on the pause list, pause message)
+    global _pause_list
+    now = time.monotonic()
+    entry = _pause_list
+    if entry and entry[0] > now:
+        return entry[1], entry[2]
+    deadline.check('pause_list')
+    names = realtime_db.reference('name').get() or []
+    message = realtime_db.reference('message').get() if names else None
+    _pause_list = (now + ttl, names, message)
+    return names, message
+
+def clear_caches():
+    global _pause_list
+    with _cache_lock:
+        _profiles.clear()
+        _pause_list = None
+
+
+# ====== Warm-up ======
+def active_participants(collection, deadline):
+    since = datetime.now(timezone.utc) - timedelta(days=ACTIVE_DAYS)
+    return [
+        snapshot.id for snapshot in db.collection(collection)
+        .where(filter=firestore.FieldFilter('last_active', '>=', since))
+        .select(['thread_id', 'is_processing'])
+        .stream(timeout=deadline.timeout('firestore.active_participants'))
+    ]
+
+def warm_instance(engines):
+    # Touch every client once and fill the caches the first replies after a reminder need.
+    # Thread IDs are not cached: they are on the user document each turn reads anyway for its
+    # processing lock, so querying the active participants is enough to open the Firestore channel.
+    deadline = Deadline(WARM_SECONDS)
+    started = time.monotonic()
+    stats = {'cold': _request_number.get() == 1, 'profiles': 0, 'profile_errors': 0}
+    pause_list(deadline, ttl=WARM_PROFILE_SECONDS)
+    for engine in engines:
+        user_ids = active_participants(engine.arm.collection, deadline)
+        stats[engine.arm.name] = len(user_ids)
+
+        def load(user_id):
+            try:
+                cached_profile(engine.line_bot_api, user_id, deadline, ttl=WARM_PROFILE_SECONDS)
+                return True
+            except Exception as e:
+                print(f"Error preloading profile of {user_id}: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=PROFILE_WORKERS) as pool:
+            for loaded in pool.map(load, user_ids):
+                stats['profiles' if loaded else 'profile_errors'] += 1
+    if any(engine.arm.assistant_enabled for engine in engines):
+        try:
+            import assistant
+
+            assistant.client.beta.assistants.retrieve(assistant.ASSISTANT_ID, timeout=deadline.timeout('assistants.retrieve'))
+        except Exception as e:
+            print(f"Error warming the OpenAI client: {e}")
+    _instance['warmed_at'] = time.time()
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
+
+def is_warm_request(req):
+    token = req.headers.get('X-Warm-Token', '')
+    return bool(WARM_TOKEN) and req.method == 'GET' and hmac.compare_digest(token, WARM_TOKEN)
+
+def warm_handler(req: https_fn.Request, engines) -> https_fn.Response:
+    note_request()
+    try:
+        stats = warm_instance(engines)
+    except Exception as e:
+        print(f"Error warming instance: {e}")
+        return https_fn.Response(response="Error", status=500)
+    print(json.dumps(dict(stats, severity='INFO', message='instance warmed')))
+    return https_fn.Response(response=json.dumps(stats), status=200, content_type='application/json')
+
+def send_warm_requests():
+    # Called by the schedule: concurrent requests so that WARM_INSTANCES instances per URL start and warm up
+    def warm(url):
+        started = time.monotonic()
+        try:
+            response = requests.get(url, headers={'X-Warm-Token': WARM_TOKEN}, timeout=WARM_SECONDS + 10)
+            return url, response.status_code, round(time.monotonic() - started, 3), response.text[:200]
+        except Exception as e:
+            return url, None, round(time.monotonic() - started, 3), str(e)
+
+    if not WARM_TOKEN or not WARM_URLS:
+        print("WARM_TOKEN or WARM_URLS is not set, skipping warm-up")
+        return
+    targets = [url for url in WARM_URLS for _ in range(WARM_INSTANCES)]
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        for url, status, seconds, detail in pool.map(warm, targets):
+            print(f"Warm-up {url}: status {status} in {seconds}s {detail}")
+
+
+# ====== Reply latency after reminders ======
+def note_request():
+    with _cache_lock:
+        _instance['requests'] += 1
+        _request_number.set(_instance['requests'])
+
+def reminder_offset(now):
+    # (reminder, minutes since it) when `now` is within the window after a reminder, else None
+    local = now.astimezone(ZoneInfo(STUDY_TIMEZONE))
+    for reminder in REMINDER_TIMES:
+        hour, minute = (int(part) for part in reminder.split(':'))
+        minutes = (local.hour * 60 + local.minute) - (hour * 60 + minute)
+        if 0 <= minutes < REMINDER_WINDOW_MINUTES:
+            return f"{local.strftime('%Y-%m-%d')} {reminder}", minutes
+    return None
+
+def log_reply_latency(arm, deadline):
+    # Cold = the first request this instance served; prewarmed = a warm-up ran on it first
+    request_number = _request_number.get()
+    offset = reminder_offset(datetime.now().astimezone())
+    if offset is None:
+        return
+    reminder, minutes = offset
+    with _cache_lock:
+        logged = _instance['logged'].get(reminder, 0)
+        if logged >= REPLY_LOG_LIMIT:
+            return
+        # Only the latest reminder is kept, earlier ones are over
+        _instance['logged'] = {reminder: logged + 1}
+    print(json.dumps({
+        'severity': 'INFO',
+        'message': 'reply latency after reminder',
+        'arm': arm,
+        'reminder': reminder,
+        'minutes_after': minutes,
+        'seconds': round(deadline.elapsed(), 3),
+        'instance': 'cold' if request_number == 1 else 'warm',
+        'prewarmed': _instance['warmed_at'] is not None,
+        'instance_age_seconds': round(time.time() - _instance['started'], 1),
+    }))
@@ -0,0 +1,83 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+
+# Backend exceptions
+import openai
+import requests
+from google.api_core import exceptions as google_exceptions
+from linebot.exceptions import LineBotApiError
+
+# Other modules import
+import random
+import threading
+import time
+from deadline import MIN_CALL_SECONDS
+
+# Load environment variables
+load_dotenv()
+
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '4'))
+RETRY_BASE_SECONDS = float(os.getenv('RETRY_BASE_SECONDS', '0.25'))
+RETRY_MAX_SECONDS = float(os.getenv('RETRY_MAX_SECONDS', '4'))
+# Time one call may spend retrying, on top of the request deadline
+RETRY_CALL_BUDGET_SECONDS = float(os.getenv('RETRY_CALL_BUDGET_SECONDS', '10'))
+
+TRANSIENT_FIRESTORE_ERRORS = (
+    google_exceptions.Aborted,             # transaction / write contention
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+)
+TRANSIENT_HTTP_STATUSES = (429, 500, 502, 503, 504)
+TRANSIENT_OPENAI_ERRORS = (
+    openai.APIConnectionError,             # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Retries per backend since the instance started
+retry_counts = {'firestore': 0, 'line': 0, 'openai': 0}
+_counts_lock = threading.Lock()
+
+
+def is_transient(backend, error):
+    if backend == 'firestore':
+        return isinstance(error, TRANSIENT_FIRESTORE_ERRORS)
+    if backend == 'line':
+        if isinstance(error, LineBotApiError):
+            return error.status_code in TRANSIENT_HTTP_STATUSES
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+    if backend == 'openai':
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in TRANSIENT_HTTP_STATUSES
+        return isinstance(error, TRANSIENT_OPENAI_ERRORS)
+    return False
+
+def backoff(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+def call_with_retry(backend, call, deadline, idempotent=True, budget=RETRY_CALL_BUDGET_SECONDS):
+    # Run `call` (a no-argument callable, so timeouts are recomputed per attempt), retrying transient errors.
+    # Non-idempotent calls are never retried: a lost response may still have been applied.
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if not idempotent or not is_transient(backend, e) or attempt + 1 >= RETRY_MAX_ATTEMPTS:
+                raise
+            delay = backoff(attempt)
+            if time.monotonic() - started + delay > budget or not deadline.has_budget(delay + MIN_CALL_SECONDS):
+                raise
+            with _counts_lock:
+                retry_counts[backend] += 1
+                total = retry_counts[backend]
+            print(f"Retrying {backend} call after {type(e).__name__} "
+                  f"(attempt {attempt + 2}/{RETRY_MAX_ATTEMPTS}, sleeping {delay:.2f}s, {total} {backend} retries so far)")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,54 @@
+import pytest
+
+from food_exchange import format_estimate, get_table, parse_quantity
+
+
+def parsed(text):
+    table = get_table()
+    return [(table.names[item], quantity, unit) for item, quantity, unit in table.extract_items(text)]
+
+
+@pytest.mark.parametrize('text, value', [
+    ('一', 1), ('兩', 2), ('十', 10), ('十二', 12), ('二十', 20),
+    ('半', 0.5), ('一半', 0.5), ('兩半', 2.5), ('1.5', 1.5), ('1/2', 0.5),
+])
+def test_parse_quantity(text, value):
+    assert parse_quantity(text) == value
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('白飯一碗', [('白飯', 1.0, '碗')]),
+    ('半碗糙米飯', [('糙米飯', 0.5, '碗')]),
+    ('白飯一半碗', [('白飯', 0.5, '碗')]),
+    ('白飯一碗半', [('白飯', 1.5, '碗')]),
+    ('白飯2碗', [('白飯', 2.0, '碗')]),
+    ('兩片吐司、牛奶1杯', [('吐司', 2.0, '片'), ('牛奶', 1.0, '杯')]),
+    ('一碗白飯一顆蘋果', [('白飯', 1.0, '碗'), ('蘋果', 1.0, '顆')]),
+    ('蘋果兩個', [('蘋果', 2.0, '個')]),
+    ('白飯', [('白飯', 1.0, '碗')]),
+])
+def test_quantity_in_item_unit(text, expected):
+    assert parsed(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('白飯一盤', [('白飯', None, '盤')]),
+    ('牛奶一瓶', [('牛奶', None, '瓶')]),
+    ('青菜一盤', [('青菜', None, '盤')]),
+])
+def test_other_unit_is_not_converted(text, expected):
+    assert parsed(text) == expected
+
+
+def test_unconverted_item_is_left_out_of_total():
+    estimate = get_table().estimate('今日飲食記錄 白飯一盤、牛奶1杯')
+    assert estimate['carb_g'] == 12
+    assert estimate['items'][0]['carb_g'] is None
+    text = format_estimate(estimate)
+    assert '白飯（以「盤」計）' in text
+    assert '合計醣類約 12 公克' in text
+
+
+def test_half_bowl_of_rice():
+    estimate = get_table().estimate('今日飲食記錄 白飯一半碗')
+    assert estimate['carb_g'] == 30
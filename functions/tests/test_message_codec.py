@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+import message_codec
+from message_codec import COMPRESSED_FIELD, decode_messages, encode_message, new_message
+
+LONG_TEXT = '今日飲食記錄：早餐吃了一碗白飯、一顆蘋果和一杯牛奶。' * 40
+
+
+@pytest.fixture(autouse=True)
+def fresh_codec(monkeypatch):
+    # Compressors and dictionaries are cached per thread / process; start every test without them
+    monkeypatch.setattr(message_codec, '_local', threading.local())
+    monkeypatch.setattr(message_codec, '_dictionaries', {})
+    monkeypatch.setattr(message_codec, 'MESSAGE_COMPRESSION', 'zstd')
+    monkeypatch.setattr(message_codec, 'MESSAGE_DICTIONARY_ID', '')
+
+
+def stored(message):
+    # What Firestore returns for a written message: a plain dict of its stored fields
+    return dict(message)
+
+
+def test_long_content_is_compressed_and_round_trips():
+    message = new_message('assistant', LONG_TEXT, '2026-10-01 11:00:00')
+    assert COMPRESSED_FIELD in stored(message)
+    assert 'content' not in stored(message)
+    assert stored(message)['dict'] == ''
+    assert len(stored(message)[COMPRESSED_FIELD]) < len(LONG_TEXT.encode('utf-8'))
+
+    [decoded] = decode_messages([stored(message)])
+    assert decoded['content'] == LONG_TEXT
+    assert decoded.get('content') == LONG_TEXT
+    assert 'content' in decoded
+    assert decoded['role'] == 'assistant'
+
+
+def test_short_content_stays_plain():
+    message = new_message('user', '白飯一碗', '2026-10-01 11:00:00')
+    assert stored(message)['content'] == '白飯一碗'
+    assert COMPRESSED_FIELD not in stored(message)
+    assert decode_messages([stored(message)])[0]['content'] == '白飯一碗'
+
+
+def test_compression_off_stores_plain(monkeypatch):
+    monkeypatch.setattr(message_codec, 'MESSAGE_COMPRESSION', 'off')
+    message = encode_message({'role': 'assistant', 'content': LONG_TEXT})
+    assert stored(message) == {'role': 'assistant', 'content': LONG_TEXT}
+
+
+def test_dictionary_id_is_stored_and_used_to_decode(monkeypatch, tmp_path):
+    (tmp_path / 'test-dict.zdict').write_bytes(LONG_TEXT[:200].encode('utf-8'))
+    monkeypatch.setattr(message_codec, 'MESSAGE_DICTIONARY_DIR', str(tmp_path))
+    monkeypatch.setattr(message_codec, 'MESSAGE_DICTIONARY_ID', 'test-dict')
+    message = new_message('assistant', LONG_TEXT, '2026-10-01 11:00:00')
+    assert stored(message)['dict'] == 'test-dict'
+
+    # Records keep decoding with their own dictionary after a newer one is deployed
+    monkeypatch.setattr(message_codec, 'MESSAGE_DICTIONARY_ID', '')
+    monkeypatch.setattr(message_codec, '_local', threading.local())
+    monkeypatch.setattr(message_codec, '_dictionaries', {})
+    assert decode_messages([stored(message)])[0]['content'] == LONG_TEXT
+
+
+def test_plain_records_read_as_before():
+    records = [
+        {'role': 'user', 'content': LONG_TEXT, 'create_at': '2026-05-01 07:00:00'},
+        {'role': 'assistant', 'content': '好的', 'create_at': '2026-05-01 07:00:00'},
+    ]
+    decoded = decode_messages(records)
+    assert [message['content'] for message in decoded] == [LONG_TEXT, '好的']
+    assert [dict(message) for message in decoded] == records
+    assert decoded[0].get('id') is None
+
+
+def test_new_messages_get_distinct_ids():
+    first = new_message('assistant', '好的', '2026-10-01 11:00:00')
+    second = new_message('assistant', '好的', '2026-10-01 11:00:00')
+    assert first['id'] and second['id'] and first['id'] != second['id']
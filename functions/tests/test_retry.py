@@ -0,0 +1,110 @@
+import httpx
+import openai
+import pytest
+import requests
+from google.api_core import exceptions as google_exceptions
+from linebot.exceptions import LineBotApiError
+from linebot.models import Error
+
+import retry
+from deadline import Deadline
+from retry import call_with_retry, is_transient
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/threads')
+
+
+def line_error(status):
+    return LineBotApiError(status, {}, error=Error(message='error'))
+
+
+def openai_status_error(error_class, status):
+    return error_class('error', response=httpx.Response(status, request=REQUEST), body=None)
+
+
+@pytest.mark.parametrize('backend, error, transient', [
+    ('firestore', google_exceptions.ServiceUnavailable('unavailable'), True),
+    ('firestore', google_exceptions.Aborted('contention'), True),
+    ('firestore', google_exceptions.DeadlineExceeded('slow'), True),
+    ('firestore', google_exceptions.NotFound('no document'), False),
+    ('firestore', google_exceptions.FailedPrecondition('changed'), False),
+    ('line', line_error(503), True),
+    ('line', line_error(429), True),
+    ('line', line_error(400), False),
+    ('line', requests.ConnectionError(), True),
+    ('line', requests.Timeout(), True),
+    ('openai', openai.APIConnectionError(request=REQUEST), True),
+    ('openai', openai.APITimeoutError(request=REQUEST), True),
+    ('openai', openai_status_error(openai.RateLimitError, 429), True),
+    ('openai', openai_status_error(openai.InternalServerError, 503), True),
+    ('openai', openai_status_error(openai.BadRequestError, 400), False),
+    ('openai', ValueError('bug'), False),
+    ('firestore', requests.ConnectionError(), False),
+])
+def test_is_transient(backend, error, transient):
+    assert is_transient(backend, error) == transient
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Record the backoff delays instead of sleeping
+    delays = []
+    monkeypatch.setattr(retry.time, 'sleep', delays.append)
+    return delays
+
+
+def failing(errors, result='ok'):
+    # A call raising the given errors in turn, then returning `result`
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return call, calls
+
+
+def test_transient_errors_are_retried(sleeps):
+    call, calls = failing([google_exceptions.ServiceUnavailable('x'), google_exceptions.Aborted('x')])
+    assert call_with_retry('firestore', call, Deadline(60)) == 'ok'
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= retry.RETRY_MAX_SECONDS for delay in sleeps)
+
+
+def test_permanent_errors_are_raised_at_once(sleeps):
+    call, calls = failing([google_exceptions.NotFound('x')])
+    with pytest.raises(google_exceptions.NotFound):
+        call_with_retry('firestore', call, Deadline(60))
+    assert len(calls) == 1
+
+
+def test_non_idempotent_calls_are_not_retried(sleeps):
+    call, calls = failing([openai.APIConnectionError(request=REQUEST)])
+    with pytest.raises(openai.APIConnectionError):
+        call_with_retry('openai', call, Deadline(60), idempotent=False)
+    assert len(calls) == 1
+
+
+def test_attempts_are_limited(sleeps):
+    call, calls = failing([google_exceptions.ServiceUnavailable('x')] * 10)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call_with_retry('firestore', call, Deadline(60))
+    assert len(calls) == retry.RETRY_MAX_ATTEMPTS
+
+
+def test_retry_stops_when_the_call_budget_is_spent(sleeps, monkeypatch):
+    monkeypatch.setattr(retry, 'backoff', lambda attempt: 1.0)
+    call, calls = failing([google_exceptions.ServiceUnavailable('x')] * 10)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call_with_retry('firestore', call, Deadline(60), budget=0.5)
+    assert len(calls) == 1
+
+
+def test_retry_stops_when_the_request_deadline_is_near(sleeps, monkeypatch):
+    monkeypatch.setattr(retry, 'backoff', lambda attempt: 1.0)
+    call, calls = failing([google_exceptions.ServiceUnavailable('x')] * 10)
+    # 6 s left, 5 s of it reserved: no room for a 1 s backoff plus another call
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        call_with_retry('firestore', call, Deadline(6))
+    assert len(calls) == 1
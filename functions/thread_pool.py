@@ -0,0 +1,104 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Firebase import
+from firebase_admin import firestore
+from firebase import db
+from google.api_core.exceptions import FailedPrecondition, NotFound
+
+# Other modules import
+from assistant import create_thread
+from deadline import Deadline
+from prewarm import STUDY_TIMEZONE
+
+# Load environment variables
+load_dotenv()
+
+# Unused Assistant threads kept ready for new participants (0 disables the pool)
+THREAD_POOL_TARGET = int(os.getenv('THREAD_POOL_TARGET', '5'))
+THREAD_POOL_COLLECTION = 'assistant_thread_pool'
+THREAD_POOL_STATS_COLLECTION = 'assistant_thread_pool_stats'
+# Pool entries read per claim, so concurrent claims can fall back to the next one
+CLAIM_CANDIDATES = 3
+# Budget of one scheduled refill
+REFILL_SECONDS = 50
+
+
+def claim_thread(deadline):
+    # Take a pre-created thread, or None when the pool is empty
+    candidates = db.collection(THREAD_POOL_COLLECTION) \
+        .order_by('create_at') \
+        .limit(CLAIM_CANDIDATES) \
+        .stream(timeout=deadline.timeout('firestore.thread_pool'))
+    for snapshot in candidates:
+        try:
+            # Only one claimer can delete the entry as it was read, the others move on
+            snapshot.reference.delete(
+                option=db.write_option(last_update_time=snapshot.update_time),
+                timeout=deadline.timeout('firestore.claim_thread')
+            )
+        except (FailedPrecondition, NotFound):
+            continue
+        return snapshot.get('thread_id')
+    return None
+
+def acquire_thread(deadline):
+    # Thread for a new participant: from the pool when possible; the pool is refilled by the refill_thread_pool schedule
+    if THREAD_POOL_TARGET <= 0:
+        return create_thread(deadline)
+
+    thread_id = None
+    try:
+        thread_id = claim_thread(deadline)
+    except Exception as e:
+        print(f"Error claiming a pooled thread: {e}")
+    claimed = thread_id is not None
+    if not claimed:
+        print("Assistant thread pool is empty, creating a thread synchronously")
+        thread_id = create_thread(deadline)
+    _record_stats({
+        'date': datetime.now(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d"),
+        'claims' if claimed else 'misses': firestore.Increment(1)
+    }, deadline)
+    return thread_id
+
+def refill_pool():
+    # Top the pool up to THREAD_POOL_TARGET and record its depth
+    if THREAD_POOL_TARGET <= 0:
+        return
+    deadline = Deadline(REFILL_SECONDS)
+    stats = {'date': datetime.now(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d")}
+    try:
+        depth = len(list(
+            db.collection(THREAD_POOL_COLLECTION)
+            .select([])
+            .limit(THREAD_POOL_TARGET)
+            .stream(timeout=deadline.timeout('firestore.thread_pool_depth'))
+        ))
+        stats['depth'] = depth
+        created = 0
+        for _ in range(THREAD_POOL_TARGET - depth):
+            thread_id = create_thread(deadline)
+            db.collection(THREAD_POOL_COLLECTION).document(thread_id).set({
+                'thread_id': thread_id,
+                'create_at': firestore.SERVER_TIMESTAMP
+            }, timeout=deadline.timeout('firestore.thread_pool_add'))
+            created += 1
+        if created:
+            stats['created'] = firestore.Increment(created)
+            print(f"Assistant thread pool refilled: depth {depth} -> {depth + created}")
+    except Exception as e:
+        print(f"Error refilling the thread pool: {e}")
+    _record_stats(stats, deadline)
+
+def _record_stats(stats, deadline):
+    # Daily claims, misses (pool empty), created threads and the last observed depth
+    try:
+        db.collection(THREAD_POOL_STATS_COLLECTION).document(stats['date']).set(dict(
+            stats, updated_at=firestore.SERVER_TIMESTAMP
+        ), merge=True, timeout=deadline.timeout('firestore.thread_pool_stats', reserve=0))
+    except Exception as e:
+        print(f"Error recording thread pool stats: {e}")
@@ -0,0 +1,85 @@
+# Per-request peak memory of the webhook handlers against local stand-ins
+# Usage (from functions/):
+#   python -m tools.bench_memory --history 400 --save before.json
+#   python -m tools.bench_memory --history 400 --baseline before.json
+
+# Other modules import
+import argparse
+import json
+import random
+import statistics
+import tracemalloc
+
+from tools import standins
+from tools.standins import REPLY_PHRASES, webhook
+from tools.replay_webhooks import sign
+
+# arm, event type, payload
+SCENARIOS = {
+    'assistant_text': ('experiment', 'message', '今日飲食記錄\n早餐：兩片吐司、牛奶1杯'),
+    'control_text': ('control', 'message', '今日飲食記錄\n早餐：兩片吐司、牛奶1杯'),
+    'postback': ('experiment', 'postback', '糖尿病飲食原則'),
+}
+
+
+def seed_history(services, user_id, history):
+    # A participant some weeks into the study: `history` stored messages, half of them long replies
+    rng = random.Random(user_id)
+    messages = []
+    for i in range(history):
+        if i % 2:
+            content = ''.join(rng.choice(REPLY_PHRASES) for _ in range(rng.randint(20, 80)))
+            messages.append({'role': 'assistant', 'content': content, 'create_at': '2026-10-01 08:00:00'})
+        else:
+            messages.append({'role': 'user', 'content': '今日飲食記錄\n午餐：一碗飯', 'create_at': '2026-10-01 08:00:00'})
+    for collection in ('users', 'users_control'):
+        services.db.collection(collection).document(user_id).set({
+            'messages': messages, 'thread_id': 'thread_bench', 'is_processing': False,
+            'pending_messages': [], 'deferred_messages': [],
+            'user_info': {'display_name': user_id, 'language': 'zh-Hant'},
+        })
+
+def bench(services, scenario, runs, history):
+    arm, kind, payload = SCENARIOS[scenario]
+    engine = services.engines[arm]
+    peaks = []
+    for run in range(runs):
+        user_id = f"Ubench{scenario}{run}"
+        seed_history(services, user_id, history)
+        body = webhook(user_id, kind, payload, run)
+        request = standins.Request(body, sign(body, engine.channel_secret))
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        response = engine.handle_request(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if response.status_code != 200:
+            raise SystemExit(f"{scenario} returned {response.status_code}")
+        peaks.append(peak / 1024)
+    return {'runs': runs, 'peak_kib_median': round(statistics.median(peaks), 1), 'peak_kib_max': round(max(peaks), 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure per-request peak memory of the webhook handlers')
+    parser.add_argument('--history', type=int, default=400, help='stored messages of each participant')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+    parser.add_argument('--save', help='write the report to this file')
+    parser.add_argument('--baseline', help='earlier report to compare with')
+    args = parser.parse_args()
+
+    services = standins.install(run_seconds=0.01)
+    report = {'history': args.history}
+    for scenario in args.scenario or sorted(SCENARIOS):
+        report[scenario] = bench(services, scenario, args.runs, args.history)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for scenario, result in report.items():
+            if isinstance(result, dict) and scenario in baseline:
+                result['baseline_peak_kib_median'] = baseline[scenario]['peak_kib_median']
+                result['change'] = f"{result['peak_kib_median'] / baseline[scenario]['peak_kib_median'] - 1:+.0%}"
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,100 @@
+# Cold starts of one function per study arm vs the unified router, on captured webhook traffic
+# Usage (from functions/, with a complete .env):
+#   python -m tools.bench_startup --source /tmp/webhooks --runs 5
+#   python -m tools.bench_startup --source /tmp/webhooks --startup-seconds 4.2 --max-rss-mb 180
+
+# Other modules import
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, like a new function instance: every deployed function loads all of main.py
+PROBE = """
+import json, resource, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+# Function serving each arm in each deployment
+DEPLOYMENTS = {
+    'split': {'experiment': 'linebot', 'control': 'linebot_control'},
+    'unified': {'experiment': 'linebot_router', 'control': 'linebot_router'},
+}
+
+
+def probe_startup(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=FUNCTIONS_DIR, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return (statistics.median(result['seconds'] for result in results),
+            statistics.median(result['max_rss_kb'] for result in results) / 1024)
+
+def simulate(records, functions, service_seconds, idle_seconds, concurrency, startup_seconds):
+    # Replays the arrival times through a pool of instances per function: a request goes to an instance
+    # with a free slot that has not been idle longer than `idle_seconds`, otherwise a new one cold starts
+    instances = {}  # function -> end times of the requests of each live instance
+    cold_by_function = {}
+    peak = 0
+    for record in records:
+        function = functions[record['arm']]
+        now = record['received_at']
+        # Scale to zero: instances idle for longer than `idle_seconds` are gone
+        pool = [ends for ends in instances.get(function, []) if max(ends) + idle_seconds >= now]
+        instances[function] = pool
+        free = [ends for ends in pool if sum(end > now for end in ends) < concurrency]
+        if free:
+            free[0].append(now + service_seconds)
+        else:
+            cold_by_function[function] = cold_by_function.get(function, 0) + 1
+            pool.append([now + startup_seconds + service_seconds])
+        peak = max(peak, sum(len(pool) for pool in instances.values()))
+    cold_starts = sum(cold_by_function.values())
+    return {
+        'requests': len(records),
+        'cold_starts': cold_starts,
+        'cold_start_rate': round(cold_starts / len(records), 3) if records else 0,
+        'cold_starts_by_function': cold_by_function,
+        'peak_instances': peak,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare cold starts of the split and unified deployments')
+    parser.add_argument('--source', required=True, help='capture directory or gs://bucket/prefix (tools.replay_webhooks)')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters timed importing main')
+    parser.add_argument('--startup-seconds', type=float, help='use this instance startup time instead of probing')
+    parser.add_argument('--max-rss-mb', type=float, help='use this instance memory instead of probing')
+    parser.add_argument('--service-seconds', type=float, default=3.0, help='time a request keeps an instance busy')
+    parser.add_argument('--idle-minutes', type=float, default=15.0, help='idle time before an instance is shut down')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests one instance serves at a time')
+    args = parser.parse_args()
+
+    from capture import load_records
+
+    records = load_records(args.source)
+    if not records:
+        raise SystemExit(f"No captured webhooks in {args.source}")
+    if args.startup_seconds is None or args.max_rss_mb is None:
+        startup_seconds, max_rss_mb = probe_startup(args.runs)
+    startup_seconds = args.startup_seconds if args.startup_seconds is not None else startup_seconds
+    max_rss_mb = args.max_rss_mb if args.max_rss_mb is not None else max_rss_mb
+
+    print(json.dumps({'instance_startup_seconds': round(startup_seconds, 3), 'instance_max_rss_mb': round(max_rss_mb, 1)}))
+    for deployment, functions in DEPLOYMENTS.items():
+        result = simulate(records, functions, args.service_seconds, args.idle_minutes * 60, args.concurrency, startup_seconds)
+        result.update(
+            deployment=deployment,
+            cold_start_seconds=round(result['cold_starts'] * startup_seconds, 2),
+            peak_memory_mb=round(result['peak_instances'] * max_rss_mb, 1),
+        )
+        print(json.dumps(result))
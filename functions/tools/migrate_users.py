@@ -0,0 +1,269 @@
+# Parallel, resumable migration / backfill of the user documents
+# Usage (from functions/):
+#   python -m tools.migrate_users --collection users --transform defaults --dry-run
+#   python -m tools.migrate_users --collection users --transform defaults --checkpoint users-defaults.json
+#   python -m tools.migrate_users --collection users --transform defaults --checkpoint users-defaults.json --verify
+
+# Other modules import
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.rpc import code_pb2
+from firebase import db
+from diet_index import adherence_fields, build_index, day_reference, day_updates
+from message_codec import COMPRESSED_FIELD, decode_messages, encode_message
+
+# Re-reads of a document that changed between its read and its rewrite (e.g. a live turn appended a message)
+MAX_DOCUMENT_ATTEMPTS = 5
+# Attempts of a write failing for any other reason, as BulkWriter does by default
+MAX_WRITE_ATTEMPTS = 15
+
+
+# ====== Transforms ======
+# A transform gets (collection, doc_id, data) and returns the fields to update, or None to skip the document.
+# Transforms that write elsewhere return a list of (reference, data) pairs, each set with merge.
+# The user document itself is only updated if it has not changed since it was read.
+def transform_defaults(collection, doc_id, data):
+    # Fields newer code expects on every user document
+    defaults = {'messages': []}
+    if collection == 'users':
+        defaults.update({'is_processing': False, 'pending_messages': [], 'deferred_messages': []})
+    updates = {field: value for field, value in defaults.items() if field not in data}
+    return updates or None
+
+def transform_diet_index(collection, doc_id, data):
+    # Backfill the per-day diet index from the message history; entries are merged, so reruns are harmless.
+    # Messages without an ID get one, written back first so every entry links to a stored message.
+    messages = decode_messages(data.get('messages', []))
+    missing_ids = any(not message.get('id') for message in messages)
+    days = build_index(messages)
+    writes = [(day_reference(collection, doc_id, date), day_updates(date, entries)) for date, entries in days.items()]
+    if missing_ids:
+        writes.insert(0, (db.collection(collection).document(doc_id), {'messages': messages}))
+    return writes or None
+
+def transform_adherence(collection, doc_id, data):
+    # last_plan_date / last_record_date from the message history, for users who predate the fields
+    fields = adherence_fields(None, data)
+    for date, entries in build_index(decode_messages(data.get('messages', []))).items():
+        for entry in entries:
+            if entry['role'] == 'user':
+                fields = adherence_fields({'kind': entry['kind'], 'date': date}, fields)
+    updates = {field: value for field, value in fields.items() if data.get(field) != value}
+    return updates or None
+
+def transform_compress_messages(collection, doc_id, data):
+    # Compress the long content of existing messages with the current codec settings; --verify checks nothing changed
+    messages = decode_messages(data.get('messages', []))
+    encoded = [message if COMPRESSED_FIELD in message else encode_message(dict(message)) for message in messages]
+    if not any(COMPRESSED_FIELD in new and COMPRESSED_FIELD not in old for new, old in zip(encoded, messages)):
+        return None
+    return {'messages': encoded}
+
+TRANSFORMS = {
+    'defaults': transform_defaults,
+    'diet_index': transform_diet_index,
+    'adherence': transform_adherence,
+    'compress_messages': transform_compress_messages,
+}
+
+
+def messages_checksum(data, count=None):
+    # Checksum of the logical conversation, which a migration must never change. With `count`, only of its
+    # first messages: those that existed when it was migrated, as live turns keep appending.
+    messages = [
+        [msg.get('role'), msg.get('content'), msg.get('create_at')]
+        for msg in decode_messages(data.get('messages', []))[:count]
+    ]
+    return hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def stream_pages(collection, page_size, start_after=None):
+    # Paginated by document ID, so a page is never held open while it is processed
+    query = db.collection(collection).order_by(FieldPath.document_id()).limit(page_size)
+    cursor = {FieldPath.document_id(): start_after} if start_after else None
+    while True:
+        page = list((query.start_after(cursor) if cursor else query).stream())
+        if not page:
+            return
+        yield page
+        cursor = page[-1]
+
+
+class Checkpoint:
+    def __init__(self, path, collection, transform):
+        self.path = path
+        self.state = {'collection': collection, 'transform': transform, 'last_doc_id': None, 'processed': 0, 'updated': 0}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved['collection'] != collection or saved['transform'] != transform:
+                raise ValueError(f"Checkpoint {path} belongs to {saved['collection']}/{saved['transform']}")
+            self.state = saved
+
+    @property
+    def checksums_path(self):
+        return f"{self.path}.checksums.jsonl"
+
+    def save(self, last_doc_id, processed, updated, checksums):
+        if not self.path:
+            return
+        with open(self.checksums_path, 'a', encoding='utf-8') as f:
+            for doc_id, checksum, count in checksums:
+                f.write(json.dumps({'id': doc_id, 'checksum': checksum, 'count': count}) + '\n')
+        self.state.update(last_doc_id=last_doc_id, processed=processed, updated=updated)
+        # Write then rename, so an interruption never leaves a truncated checkpoint
+        with open(f"{self.path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def load_checksums(self):
+        checksums = {}
+        if self.path and os.path.exists(self.checksums_path):
+            with open(self.checksums_path, encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    # Checkpoints written before message counts were recorded cover the whole conversation
+                    checksums[entry['id']] = (entry['checksum'], entry.get('count'))
+        return checksums
+
+
+def migrate(collection, transform_name, page_size, workers, dry_run, checkpoint):
+    transform = TRANSFORMS[transform_name]
+    processed = checkpoint.state['processed']
+    updated = checkpoint.state['updated']
+    started = time.monotonic()
+    if checkpoint.state['last_doc_id']:
+        print(f"Resuming after {checkpoint.state['last_doc_id']} ({processed} documents done)")
+
+    def prepare(snapshot):
+        # Transform one document: the update of the document itself and the writes to other documents
+        data = snapshot.to_dict()
+        updates = transform(collection, snapshot.id, data)
+        if updates is None:
+            return snapshot, data, None, None, []
+        writes = updates if isinstance(updates, list) else [(snapshot.reference, updates)]
+        own = next((fields for reference, fields in writes if reference.path == snapshot.reference.path), None)
+        others = [(reference, fields) for reference, fields in writes if reference.path != snapshot.reference.path]
+        return snapshot, data, updates, own, others
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in stream_pages(collection, page_size, checkpoint.state['last_doc_id']):
+            done = []
+            pending = page
+            for _ in range(MAX_DOCUMENT_ATTEMPTS):
+                prepared = list(pool.map(prepare, pending))
+                # Each rewrite is preconditioned on the version that was transformed
+                changed = set() if dry_run else bulk_write(updates=[
+                    (snapshot.reference, own, db.write_option(last_update_time=snapshot.update_time))
+                    for snapshot, data, updates, own, others in prepared if own is not None
+                ])
+                done += [item for item in prepared if item[0].reference.path not in changed]
+                if not changed:
+                    break
+                # Only the documents that changed since they were read are read and transformed again
+                pending = [
+                    snapshot for snapshot in db.get_all([item[0].reference for item in prepared if item[0].reference.path in changed])
+                    if snapshot.exists
+                ]
+            else:
+                raise RuntimeError(f"{len(changed)} documents kept changing during the migration, rerun to retry them")
+
+            # Writes elsewhere (e.g. the diet index) only follow a rewrite that succeeded
+            if not dry_run:
+                bulk_write(sets=[write for item in done for write in item[4]])
+            checksums = [(snapshot.id, messages_checksum(data), len(data.get('messages', []))) for snapshot, data, *_ in done]
+            updated += sum(1 for item in done if item[2] is not None)
+            processed += len(page)
+
+            # The checkpoint only moves once every write of the page is committed
+            if not dry_run:
+                checkpoint.save(page[-1].id, processed, updated, checksums)
+            elapsed = time.monotonic() - started
+            print(f"{processed} documents, {updated} {'to update' if dry_run else 'updated'}, "
+                  f"{processed / elapsed:.1f} docs/s")
+
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        'collection': collection,
+        'transform': transform_name,
+        'dry_run': dry_run,
+        'processed': processed,
+        'updated': updated,
+        'seconds': round(elapsed, 1),
+        'docs_per_second': round(processed / elapsed, 1) if elapsed else None
+    }))
+
+def bulk_write(updates=(), sets=()):
+    # Updates (reference, fields, option) and merged sets (reference, fields) through one BulkWriter, which
+    # batches them without making them atomic. Returns the paths whose precondition failed; writes that
+    # fail for another reason are retried, then raised.
+    changed = set()
+    failed = []
+
+    def on_error(error, writer):
+        if error.code == code_pb2.FAILED_PRECONDITION:
+            changed.add(error.operation.reference.path)
+            return False
+        if error.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        failed.append(f"{error.operation.reference.path}: {error.message}")
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_error)
+    for reference, fields, option in updates:
+        writer.update(reference, fields, option=option)
+    for reference, fields in sets:
+        writer.set(reference, fields, merge=True)
+    writer.close()
+    if failed:
+        raise RuntimeError(f"{len(failed)} writes failed, rerun to retry them: {failed[:5]}")
+    return changed
+
+def verify(collection, page_size, checkpoint):
+    # Compare document counts and conversation checksums with the ones recorded during the migration;
+    # messages added after a document was migrated are not part of its checksum
+    recorded = checkpoint.load_checksums()
+    seen = 0
+    mismatches = []
+    for page in stream_pages(collection, page_size):
+        for snapshot in page:
+            seen += 1
+            expected, count = recorded.get(snapshot.id, (None, None))
+            if expected is not None and expected != messages_checksum(snapshot.to_dict(), count):
+                mismatches.append(snapshot.id)
+    result = {
+        'collection': collection,
+        'documents': seen,
+        'migrated': len(recorded),
+        'checkpoint_processed': checkpoint.state['processed'],
+        'checksum_mismatches': mismatches,
+        'ok': not mismatches and seen >= len(recorded) == checkpoint.state['processed']
+    }
+    print(json.dumps(result))
+    return result['ok']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate or backfill user documents')
+    parser.add_argument('--collection', required=True, choices=['users', 'users_control'])
+    parser.add_argument('--transform', required=True, choices=sorted(TRANSFORMS))
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--checkpoint', help='checkpoint file, required unless --dry-run')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+    parser.add_argument('--verify', action='store_true', help='verify a finished migration against its checkpoint')
+    args = parser.parse_args()
+
+    if not args.dry_run and not args.checkpoint:
+        parser.error('--checkpoint is required unless --dry-run')
+
+    checkpoint = Checkpoint(None if args.dry_run else args.checkpoint, args.collection, args.transform)
+    if args.verify:
+        raise SystemExit(0 if verify(args.collection, args.page_size, checkpoint) else 1)
+    migrate(args.collection, args.transform, args.page_size, args.workers, args.dry_run, checkpoint)
@@ -0,0 +1,125 @@
+# Deterministic replay of captured webhook traffic against local service stand-ins
+# Usage (from functions/):
+#   python -m tools.replay_webhooks --source /tmp/webhooks --speed 10 --save-baseline baseline.json
+#   python -m tools.replay_webhooks --source gs://bucket/webhooks --speed 10 --baseline baseline.json
+
+# Other modules import
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import statistics
+import sys
+import threading
+import time
+
+from tools import standins
+
+PERCENTILES = [50, 90, 99]
+
+
+def sign(body, channel_secret):
+    digest = hmac.new(channel_secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def distribution(latencies):
+    if not latencies:
+        return {'count': 0}
+    result = {'count': len(latencies), 'mean': round(statistics.mean(latencies), 4), 'max': round(max(latencies), 4)}
+    for p in PERCENTILES:
+        result[f"p{p}"] = round(percentile(latencies, p), 4)
+    return result
+
+def replay(records, services, speed):
+    # Each webhook starts at its original offset divided by `speed`, concurrently like production traffic
+    latencies = {}
+    statuses = {}
+    lock = threading.Lock()
+    first = records[0]['received_at']
+    started = time.monotonic()
+
+    def send(record):
+        engine = services.engines[record['arm']]
+        request = standins.Request(record['body'], sign(record['body'], engine.channel_secret))
+        request_started = time.monotonic()
+        response = engine.handle_request(request)
+        elapsed = time.monotonic() - request_started
+        with lock:
+            latencies.setdefault(record['arm'], []).append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = []
+    for record in records:
+        delay = (record['received_at'] - first) / speed - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=send, args=(record,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    report = {
+        'webhooks': len(records),
+        'speed': speed,
+        'wall_seconds': round(time.monotonic() - started, 2),
+        'statuses': statuses,
+        'all': distribution([value for values in latencies.values() for value in values]),
+    }
+    for arm, values in sorted(latencies.items()):
+        report[arm] = distribution(values)
+    return report
+
+def compare(report, baseline, tolerance):
+    # Regressions are percentiles slower than the baseline by more than `tolerance` (0.2 = 20%)
+    regressions = []
+    for group in baseline:
+        if not isinstance(baseline[group], dict) or group not in report or group == 'statuses':
+            continue
+        for p in PERCENTILES:
+            key = f"p{p}"
+            if key in baseline[group] and key in report[group] and baseline[group][key] > 0:
+                ratio = report[group][key] / baseline[group][key]
+                if ratio > 1 + tolerance:
+                    regressions.append({'group': group, 'percentile': key, 'baseline': baseline[group][key],
+                                        'current': report[group][key], 'ratio': round(ratio, 2)})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay captured webhooks and report latency distributions')
+    parser.add_argument('--source', required=True, help='capture directory or gs://bucket/prefix')
+    parser.add_argument('--speed', type=float, default=1.0, help='timing scale, 10 replays 10x faster')
+    parser.add_argument('--firestore-latency', type=float, default=0.01, help='seconds per Firestore call')
+    parser.add_argument('--line-latency', type=float, default=0.05, help='seconds per LINE call')
+    parser.add_argument('--openai-latency', type=float, default=0.1, help='seconds per OpenAI call')
+    parser.add_argument('--run-seconds', type=float, default=3.0, help='seconds until an Assistant run completes')
+    parser.add_argument('--baseline', help='baseline report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', help='write this report as the new baseline')
+    args = parser.parse_args()
+
+    # Stand-ins first: the handlers bind their clients when imported
+    services = standins.install(args.firestore_latency, args.line_latency, args.openai_latency, args.run_seconds)
+    from capture import load_records
+
+    records = load_records(args.source)
+    if not records:
+        raise SystemExit(f"No captured webhooks in {args.source}")
+    report = replay(records, services, args.speed)
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        print(json.dumps({'regressions': regressions}, indent=2))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,260 @@
+# Synthetic study cohort sent through the real webhook handlers, measuring how the schema scales with study days
+# Usage (from functions/):
+#   python -m tools.simulate_cohort --participants 100 --days 60 --output cohort.json
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python -m tools.simulate_cohort --emulator --participants 20 --days 60
+
+# Other modules import
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from tools import standins
+from tools.standins import REPLY_PHRASES, webhook
+from tools.replay_webhooks import distribution, sign
+
+# Phase 1 is days 1-30, phase 2 (plans and satisfaction ratings) days 31-60
+PHASE_DAYS = 30
+MEALS = ['早餐', '午餐', '晚餐', '點心']
+FOODS = ['一碗飯', '半碗糙米飯', '兩片吐司', '一個饅頭', '一碗麵', '燙青菜', '一盤炒青菜', '一顆蛋', '一塊雞腿',
+         '一片鮭魚', '一杯豆漿', '牛奶1杯', '一顆蘋果', '一根香蕉', '一碗地瓜稀飯', '滷豆腐兩塊', '一份水餃']
+QUESTIONS = ['請問糖尿病可以吃水果嗎？', '外食要怎麼選比較好？', '今天血糖有點高怎麼辦', '喝無糖豆漿可以嗎？', '謝謝']
+# Participants per arm whose week of diet days is read each day to time that query
+SAMPLE_PARTICIPANTS = 10
+
+
+class SimulatedClock:
+    # `now` is the participants' local time (STUDY_TIMEZONE)
+    def __init__(self, now):
+        self.now = now
+
+
+def patch_datetime(clock):
+    # The handlers date messages, indexes and ledgers with datetime.now(); make that the simulated time
+    import linebot_engine
+    import thread_pool
+    import usage
+
+    class SimulatedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            # Without a timezone, server time: UTC, as on Cloud Functions
+            if tz is None:
+                return clock.now.astimezone(timezone.utc).replace(tzinfo=None)
+            return clock.now.astimezone(tz)
+
+    for module in (linebot_engine, thread_pool, usage):
+        module.datetime = SimulatedDatetime
+
+
+class Participant:
+    def __init__(self, arm, rng, days):
+        self.arm = arm
+        self.user_id = 'U' + format(rng.getrandbits(128), '032x')
+        self.display_name = standins.Profile(self.user_id).display_name
+        # Adherence drifts down over the study; some participants are far more talkative than others
+        self.record_rate = rng.uniform(0.4, 0.95)
+        self.plan_rate = rng.uniform(0.3, 0.9)
+        self.fatigue = rng.uniform(0.0, 0.006)
+        self.verbosity = rng.randint(1, 4)
+        self.burstiness = rng.uniform(0.0, 0.5)
+        self.question_rate = rng.uniform(0.0, 0.3)
+        # Silent stretches (travel, illness) and days on the staff pause list
+        self.silent_days = set()
+        for _ in range(rng.randint(0, 2)):
+            start = rng.randint(1, days)
+            self.silent_days.update(range(start, start + rng.randint(2, 6)))
+        self.paused_days = set()
+        if rng.random() < 0.1:
+            start = rng.randint(1, days)
+            self.paused_days.update(range(start, start + rng.randint(1, 3)))
+
+    def sessions(self, day, rng):
+        # (hour, messages) of one simulated day; the messages of a session are sent back to back
+        if day in self.silent_days:
+            return []
+        fatigue = 1 - self.fatigue * day
+        sessions = []
+        if day > PHASE_DAYS and rng.random() < self.plan_rate * fatigue:
+            plan = '、'.join(rng.sample(FOODS, 3 + self.verbosity))
+            sessions.append((7, ['今日飲食規劃', f"今天打算吃{plan}"]))
+        if rng.random() < self.question_rate:
+            sessions.append((rng.choice([10, 12, 15, 21]), [rng.choice(QUESTIONS)]))
+        if rng.random() < 0.05:
+            sessions.append((rng.choice([9, 13, 20]), [('postback', '糖尿病飲食原則')]))
+        if rng.random() < self.record_rate * fatigue:
+            meals = [f"{meal}：{'、'.join(rng.sample(FOODS, rng.randint(1, 1 + self.verbosity)))}" for meal in MEALS[:rng.randint(2, 4)]]
+            messages = ['今日飲食記錄'] + (meals if rng.random() < self.burstiness else ['\n'.join(meals)])
+            if day > PHASE_DAYS:
+                messages.append(f"今天的健康管理滿意度：{rng.randint(3, 10)}分")
+            sessions.append((19, messages))
+        return sessions
+
+
+class Simulation:
+    def __init__(self, services, participants, start, days, workers, seed):
+        self.services = services
+        self.rng = random.Random(seed)
+        self.start = start
+        self.days = days
+        self.workers = workers
+        self.clock = SimulatedClock(start)
+        patch_datetime(self.clock)
+        # Imported once here, not at module level: like the handlers, prewarm binds `firebase` when imported,
+        # which must be the stand-ins installed in __main__
+        from prewarm import clear_caches
+        self.clear_caches = clear_caches
+        self.cohort = [Participant(arm, self.rng, days) for arm in ('experiment', 'control') for _ in range(participants)]
+        self.event_id = 0
+        self.in_memory = isinstance(services.db, standins.InMemoryFirestore)
+
+    def send(self, participant, messages, burst):
+        engine = self.services.engines[participant.arm]
+        latencies = []
+
+        def post(message):
+            kind, payload = message if isinstance(message, tuple) else ('message', message)
+            body = webhook(participant.user_id, kind, payload, self.next_event_id())
+            started = time.monotonic()
+            engine.handle_request(standins.Request(body, sign(body, engine.channel_secret)))
+            latencies.append(time.monotonic() - started)
+
+        if burst:
+            # Back to back messages arrive while the first is still being answered
+            with ThreadPoolExecutor(max_workers=len(messages)) as pool:
+                list(pool.map(post, messages))
+        else:
+            for message in messages:
+                post(message)
+        return latencies
+
+    def next_event_id(self):
+        self.event_id += 1
+        return self.event_id
+
+    def counters(self):
+        db = self.services.db
+        if not self.in_memory:
+            return None
+        return {'reads': db.reads, 'writes': db.writes, 'read_bytes': db.read_bytes, 'write_bytes': db.write_bytes}
+
+    def run_day(self, day):
+        date = self.start + timedelta(days=day - 1)
+        # The pause list changes from day to day; drop the cached one
+        self.clear_caches()
+        rng = random.Random(f"{self.rng.random()}-{day}")
+        self.services.realtime_db.data['name'] = [p.display_name for p in self.cohort if day in p.paused_days]
+        self.services.openai.reply = ''.join(rng.choice(REPLY_PHRASES) for _ in range(rng.randint(20, 80)))
+        plans = {participant: participant.sessions(day, rng) for participant in self.cohort}
+
+        result = {'day': day, 'date': date.strftime("%Y-%m-%d")}
+        for arm in ('experiment', 'control'):
+            before = self.counters()
+            latencies = []
+            messages = 0
+            for hour in sorted({hour for sessions in plans.values() for hour, _ in sessions}):
+                self.clock.now = date.replace(hour=hour, minute=rng.randint(0, 20))
+                batch = [
+                    (participant, session, rng.random() < participant.burstiness)
+                    for participant, sessions in plans.items() if participant.arm == arm
+                    for session_hour, session in sessions if session_hour == hour
+                ]
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for session_latencies in pool.map(lambda item: self.send(*item), batch):
+                        latencies.extend(session_latencies)
+                messages += sum(len(session) for _, session, _ in batch)
+            after = self.counters()
+            result[arm] = {'messages': messages, 'latency': distribution(latencies)}
+            if before and messages:
+                result[arm].update({
+                    f"{key}_per_message": round((after[key] - before[key]) / messages, 1) for key in before
+                })
+        self.services.line_bot_api.replies.clear()
+        self.measure(result, date)
+        return result
+
+    def measure(self, result, date):
+        # Document sizes of both collections and the latency of the study-staff queries at the end of the day
+        from adherence import query_missing
+        from diet_index import get_diet_days
+        from usage import get_usage_totals
+
+        day = date.strftime("%Y-%m-%d")
+        week_start = (date - timedelta(days=6)).strftime("%Y-%m-%d")
+        for arm, collection in (('experiment', 'users'), ('control', 'users_control')):
+            # An export job reads every user document in full
+            started = time.monotonic()
+            sizes = [
+                standins.document_size(snapshot.reference.path, snapshot.to_dict())
+                for snapshot in self.services.db.collection(collection).stream()
+            ]
+            export_seconds = time.monotonic() - started
+            started = time.monotonic()
+            missing = query_missing(collection, day, 'record', 200)
+            adherence_seconds = time.monotonic() - started
+            sample = [p for p in self.cohort if p.arm == arm][:SAMPLE_PARTICIPANTS]
+            started = time.monotonic()
+            for participant in sample:
+                get_diet_days(collection, participant.user_id, week_start, day)
+            diet_week_seconds = (time.monotonic() - started) / max(len(sample), 1)
+
+            result[arm]['documents'] = {
+                'count': len(sizes),
+                'kib_p50': round(sorted(sizes)[len(sizes) // 2] / 1024, 1) if sizes else 0,
+                'kib_max': round(max(sizes) / 1024, 1) if sizes else 0,
+                'over_512kib': sum(size > 512 * 1024 for size in sizes),
+            }
+            result[arm]['queries_ms'] = {
+                'export_scan': round(export_seconds * 1000, 1),
+                'adherence_missing_record': round(adherence_seconds * 1000, 1),
+                'adherence_rows': len(missing['users']),
+                'diet_week': round(diet_week_seconds * 1000, 2),
+            }
+        started = time.monotonic()
+        get_usage_totals(day)
+        result['usage_totals_ms'] = round((time.monotonic() - started) * 1000, 1)
+
+
+def summary_line(result):
+    parts = [f"day {result['day']:>3}"]
+    for arm in ('experiment', 'control'):
+        stats = result[arm]
+        parts.append(
+            f"{arm}: {stats['messages']} msgs, p90 {stats['latency'].get('p90', 0) * 1000:.0f}ms, "
+            f"doc p50/max {stats['documents']['kib_p50']}/{stats['documents']['kib_max']} KiB, "
+            f"{stats.get('read_bytes_per_message', '-')}/{stats.get('write_bytes_per_message', '-')} B read/written per msg, "
+            f"export {stats['queries_ms']['export_scan']}ms"
+        )
+    return ' | '.join(parts)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a study cohort and measure the storage schema over time')
+    parser.add_argument('--participants', type=int, default=50, help='participants per arm')
+    parser.add_argument('--days', type=int, default=2 * PHASE_DAYS)
+    parser.add_argument('--start', default='2026-11-01', help='first study day (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=16, help='participants served concurrently at a reminder')
+    parser.add_argument('--run-seconds', type=float, default=0.0, help='seconds until an Assistant run completes (0 = at the first poll)')
+    parser.add_argument('--firestore-latency', type=float, default=0.0, help='seconds per in-memory Firestore call')
+    parser.add_argument('--emulator', action='store_true', help='write to the Firestore emulator at FIRESTORE_EMULATOR_HOST')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the per-day results as JSON')
+    args = parser.parse_args()
+
+    services = standins.install(firestore_latency=args.firestore_latency, run_seconds=args.run_seconds,
+                                firestore_emulator=args.emulator)
+    from prewarm import STUDY_TIMEZONE
+
+    start = datetime.strptime(args.start, "%Y-%m-%d").replace(tzinfo=ZoneInfo(STUDY_TIMEZONE))
+    simulation = Simulation(services, args.participants, start,
+                            args.days, args.workers, args.seed)
+    results = []
+    for day in range(1, args.days + 1):
+        results.append(simulation.run_day(day))
+        print(summary_line(results[-1]), flush=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
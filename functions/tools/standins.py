@@ -0,0 +1,620 @@
+# Local stand-ins for Firestore, the Realtime Database, LINE and OpenAI, used by the replay and benchmark tools
+# install() must run before any module that imports `firebase` is imported.
+
+# Other modules import
+import copy
+import json
+import os
+import sys
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore_v1 import transforms
+from google.rpc import code_pb2
+
+DOCUMENT_ID = '__name__'
+
+
+# ====== Firestore ======
+def apply_value(current, value):
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, transforms.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current or [])
+        result.extend(item for item in value.values if item not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in (current or []) if item not in value.values]
+    if isinstance(value, dict):
+        return {key: apply_value(None, item) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+def value_size(value):
+    # Firestore storage size rules (firebase.google.com/docs/firestore/storage-size)
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(len(str(key).encode('utf-8')) + 1 + value_size(item) for key, item in value.items())
+    if isinstance(value, (transforms.ArrayUnion, transforms.ArrayRemove)):
+        return value_size(list(value.values))
+    if isinstance(value, DocumentReference):
+        return document_name_size(value.path)
+    # Numbers, timestamps and the other transforms
+    return 8
+
+def document_name_size(path):
+    return sum(len(part.encode('utf-8')) + 1 for part in path.split('/')) + 16
+
+def document_size(path, data):
+    return document_name_size(path) + value_size(data) + 32
+
+def set_path(data, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        data = data.setdefault(key, {})
+    if value is transforms.DELETE_FIELD:
+        data.pop(keys[-1], None)
+    else:
+        data[keys[-1]] = apply_value(data.get(keys[-1]), value)
+
+def get_path(data, path):
+    for key in path.split('.'):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+def merge_into(data, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            merge_into(data[key], value)
+        else:
+            set_path(data, key, value)
+
+
+class Snapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return copy.deepcopy(get_path(self._data or {}, field))
+
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._store, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, timeout=None, **kwargs):
+        return self._store.read(self, field_paths)
+
+    def set(self, document_data, merge=False, timeout=None, **kwargs):
+        self._store.write(self, document_data, merge=merge)
+
+    def update(self, field_updates, option=None, timeout=None, **kwargs):
+        self._store.write(self, field_updates, update=True, option=option)
+
+    def delete(self, option=None, timeout=None, **kwargs):
+        self._store.delete(self, option)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class Query:
+    def __init__(self, store, path, filters=(), orders=(), limit=None, cursor=None, projection=None):
+        self._store = store
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     cursor=self._cursor, projection=self._projection)
+        state.update(changes)
+        return Query(self._store, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def stream(self, transaction=None, timeout=None, **kwargs):
+        return iter(self._store.query(self))
+
+    def get(self, transaction=None, timeout=None, **kwargs):
+        return self._store.query(self)
+
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._store, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None, timeout=None, **kwargs):
+        reference = self.document(document_id)
+        reference.set(document_data)
+        return datetime.now(timezone.utc), reference
+
+
+class WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(lambda: self._store.write(reference, document_data, merge=merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(lambda: self._store.write(reference, field_updates, update=True, option=option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(lambda: self._store.delete(reference))
+
+    def commit(self, timeout=None, **kwargs):
+        with self._store.lock:
+            for write in self._writes:
+                write()
+        self._writes = []
+
+
+class BulkWriter:
+    # Writes on flush/close; a failed write is reported to the on_write_error callback, which decides on a retry
+    def __init__(self, store):
+        self._store = store
+        self._operations = []
+        self._on_error = lambda error, writer: error.attempts < 15
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def set(self, reference, document_data, merge=False):
+        self._operations.append((reference, lambda: self._store.write(reference, document_data, merge=merge)))
+
+    def update(self, reference, field_updates, option=None):
+        self._operations.append((reference, lambda: self._store.write(reference, field_updates, update=True, option=option)))
+
+    def flush(self):
+        operations, self._operations = self._operations, []
+        for reference, write in operations:
+            attempts = 0
+            while True:
+                try:
+                    write()
+                    break
+                except Exception as e:
+                    attempts += 1
+                    code = code_pb2.FAILED_PRECONDITION if isinstance(e, FailedPrecondition) else code_pb2.UNKNOWN
+                    failure = types.SimpleNamespace(operation=types.SimpleNamespace(reference=reference),
+                                                    code=code, message=str(e), attempts=attempts)
+                    if not self._on_error(failure, self):
+                        break
+
+    def close(self):
+        self.flush()
+
+
+class InMemoryFirestore:
+    # Thread-safe subset of the Firestore client used by this code base, with read/write counters
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.documents = {}
+        self.update_times = {}
+        self.lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+        # Bytes of the documents returned and of the data sent, by document_size()
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def bulk_writer(self):
+        return BulkWriter(self)
+
+    def write_option(self, **kwargs):
+        return types.SimpleNamespace(**kwargs)
+
+    def get_all(self, references, field_paths=None, transaction=None, timeout=None, **kwargs):
+        return [reference.get(field_paths) for reference in references]
+
+    def read(self, reference, field_paths=None):
+        self._wait()
+        with self.lock:
+            self.reads += 1
+            data = self.documents.get(reference.path)
+            if data is not None and field_paths is not None:
+                projected = {}
+                for field in field_paths:
+                    value = get_path(data, field)
+                    if value is not None:
+                        set_path(projected, field, value)
+                data = projected
+            if data is not None:
+                self.read_bytes += document_size(reference.path, data)
+            return Snapshot(reference, copy.deepcopy(data), self.update_times.get(reference.path))
+
+    def write(self, reference, data, merge=False, update=False, option=None):
+        self._wait()
+        with self.lock:
+            self.check_precondition(reference, option)
+            self.writes += 1
+            self.write_bytes += document_size(reference.path, data)
+            current = self.documents.get(reference.path)
+            if update:
+                if current is None:
+                    raise KeyError(f"No document to update: {reference.path}")
+                for key, value in data.items():
+                    set_path(current, key, value)
+            elif merge and current is not None:
+                merge_into(current, data)
+            else:
+                current = {}
+                merge_into(current, data)
+            self.documents[reference.path] = current
+            self.update_times[reference.path] = datetime.now(timezone.utc)
+
+    def check_precondition(self, reference, option):
+        last_update_time = getattr(option, 'last_update_time', None)
+        if last_update_time is not None and self.update_times.get(reference.path) != last_update_time:
+            raise FailedPrecondition(f"Document changed or deleted: {reference.path}")
+
+    def delete(self, reference, option=None):
+        self._wait()
+        with self.lock:
+            self.check_precondition(reference, option)
+            self.writes += 1
+            self.documents.pop(reference.path, None)
+            self.update_times.pop(reference.path, None)
+
+    def query(self, query):
+        self._wait()
+        with self.lock:
+            prefix = query._path + '/'
+            results = [
+                (path, data) for path, data in self.documents.items()
+                if path.startswith(prefix) and '/' not in path[len(prefix):]
+            ]
+        results = [(path, data) for path, data in results if all(
+            matches(path if field == DOCUMENT_ID else get_path(data, field), op, value)
+            for field, op, value in query._filters
+        )]
+        for field, direction in reversed(query._orders + [(DOCUMENT_ID, 'ASCENDING')]):
+            results = [(path, data) for path, data in results if field == DOCUMENT_ID or get_path(data, field) is not None]
+            results.sort(
+                key=lambda item: item[0] if field == DOCUMENT_ID else get_path(item[1], field),
+                reverse=direction == 'DESCENDING'
+            )
+        if query._cursor is not None:
+            results = results[cursor_position(query, results):]
+        if query._limit is not None:
+            results = results[:query._limit]
+        with self.lock:
+            self.reads += max(len(results), 1)
+        snapshots = []
+        for path, data in results:
+            if query._projection is not None:
+                projected = {}
+                for field in query._projection:
+                    value = get_path(data, field)
+                    if value is not None:
+                        set_path(projected, field, value)
+                data = projected
+            snapshots.append(Snapshot(DocumentReference(self, path), copy.deepcopy(data), self.update_times.get(path)))
+        with self.lock:
+            self.read_bytes += sum(document_size(path, data) for path, data in results) if query._projection is None \
+                else sum(document_size(snapshot.reference.path, snapshot._data) for snapshot in snapshots)
+        return snapshots
+
+
+def matches(current, op, value):
+    if op == '==':
+        return current == value
+    if op == '!=':
+        return current is not None and current != value
+    if current is None:
+        return False
+    if op == '<':
+        return current < value
+    if op == '<=':
+        return current <= value
+    if op == '>':
+        return current > value
+    if op == '>=':
+        return current >= value
+    if op == 'in':
+        return current in value
+    if op == 'array-contains':
+        return value in current
+    raise ValueError(f"Unsupported operator {op}")
+
+def cursor_position(query, results):
+    cursor = query._cursor
+    if isinstance(cursor, Snapshot):
+        cursor = dict(cursor._data or {}, **{DOCUMENT_ID: cursor.id})
+    orders = query._orders + [(DOCUMENT_ID, 'ASCENDING')]
+    keys = []
+    for field, _ in orders:
+        if field not in cursor:
+            break
+        value = cursor[field]
+        keys.append(value.id if isinstance(value, DocumentReference) else value)
+
+    def key_of(item):
+        path, data = item
+        return [path.rsplit('/', 1)[-1] if field == DOCUMENT_ID else get_path(data, field) for field, _ in orders[:len(keys)]]
+
+    descending = orders[0][1] == 'DESCENDING'
+    for index, item in enumerate(results):
+        key = key_of(item)
+        if (key < keys) if descending else (key > keys):
+            return index
+    return len(results)
+
+
+class RealtimeReference:
+    def __init__(self, data, path):
+        self._data = data
+        self._path = path
+
+    def get(self, etag=False, shallow=False):
+        return copy.deepcopy(self._data.get(self._path))
+
+    def set(self, value):
+        self._data[self._path] = copy.deepcopy(value)
+
+
+class InMemoryRealtimeDatabase:
+    def __init__(self, data=None):
+        self.data = data or {}
+
+    def reference(self, path='/'):
+        return RealtimeReference(self.data, path.strip('/'))
+
+
+# ====== LINE ======
+class Profile:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.display_name = f"participant-{user_id[-6:]}"
+        self.language = 'zh-Hant'
+
+
+class MessageContent:
+    def __init__(self, data, content_type='image/jpeg', chunk_size=64 * 1024):
+        self._data = data
+        self.content_type = content_type
+        self._chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        size = chunk_size or self._chunk_size
+        for start in range(0, len(self._data), size):
+            yield self._data[start:start + size]
+
+
+class LineBotApiStandin:
+    def __init__(self, latency=0.0, content=b''):
+        self.latency = latency
+        self.content = content
+        self.replies = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_profile(self, user_id, timeout=None):
+        self._wait()
+        return Profile(user_id)
+
+    def reply_message(self, reply_token, messages, notification_disabled=False, timeout=None):
+        self._wait()
+        with self._lock:
+            self.replies.append((reply_token, messages))
+
+    def push_message(self, to, messages, notification_disabled=False, timeout=None, **kwargs):
+        self.reply_message(to, messages)
+
+    def get_message_content(self, message_id, timeout=None):
+        self._wait()
+        return MessageContent(self.content)
+
+
+# ====== OpenAI ======
+# Phrases the stand-in Assistant replies are built from, for realistic reply lengths
+REPLY_PHRASES = [
+    '您好！根據您的飲食記錄，', '早餐的全穀雜糧類約2份，', '建議增加蔬菜類的攝取，', '醣類份數控制在每餐3-4份，',
+    '記得搭配適量的豆魚蛋肉類，', '水果建議一天2份，', '今天的血糖控制表現得很好喔！', '糖尿病飲食原則是均衡、定時、定量。',
+]
+
+class Namespace(types.SimpleNamespace):
+    pass
+
+
+class OpenAIStandin:
+    # Assistant API subset: every Run completes `run_seconds` after it is created
+    def __init__(self, latency=0.0, run_seconds=2.0, reply="這是本地測試回覆。", tokens=(800, 200)):
+        self.latency = latency
+        self.run_seconds = run_seconds
+        self.reply = reply
+        self.tokens = tokens
+        self.runs = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.beta = Namespace(threads=Namespace(
+            create=self._create_thread,
+            messages=Namespace(create=self._create_message, list=self._list_messages),
+            runs=Namespace(create=self._create_run, retrieve=self._retrieve_run, cancel=self._cancel_run),
+        ))
+        self.files = Namespace(create=self._create_file)
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _create_thread(self, timeout=None, **kwargs):
+        self._wait()
+        return Namespace(id=f"thread_{uuid.uuid4().hex[:24]}")
+
+    def _create_message(self, thread_id, role, content, timeout=None, **kwargs):
+        self._wait()
+        return Namespace(id=f"msg_{uuid.uuid4().hex[:24]}")
+
+    def _create_file(self, file, purpose, timeout=None, **kwargs):
+        self._wait()
+        return Namespace(id=f"file_{uuid.uuid4().hex[:24]}")
+
+    def _create_run(self, thread_id, assistant_id, timeout=None, **kwargs):
+        self._wait()
+        run_id = f"run_{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self.runs[run_id] = {'created': time.monotonic(), 'status': 'queued'}
+        return Namespace(id=run_id, status='queued', usage=None)
+
+    def _retrieve_run(self, thread_id, run_id, timeout=None, **kwargs):
+        self._wait()
+        with self._lock:
+            run = self.runs[run_id]
+            if run['status'] != 'cancelled' and time.monotonic() - run['created'] >= self.run_seconds:
+                run['status'] = 'completed'
+            status = run['status'] if run['status'] != 'queued' else 'in_progress'
+        usage = None
+        if status == 'completed':
+            usage = Namespace(prompt_tokens=self.tokens[0], completion_tokens=self.tokens[1], total_tokens=sum(self.tokens))
+        return Namespace(id=run_id, status=status, usage=usage)
+
+    def _cancel_run(self, thread_id, run_id, timeout=None, **kwargs):
+        self._wait()
+        with self._lock:
+            self.runs[run_id]['status'] = 'cancelled'
+
+    def _list_messages(self, thread_id, timeout=None, **kwargs):
+        self._wait()
+        text = Namespace(value=self.reply)
+        return Namespace(data=[Namespace(content=[Namespace(text=text)])])
+
+
+# ====== Installation ======
+# Credentials the stand-in LINE channels are signed with
+STANDIN_ENV = {
+    'CHANNEL_ACCESS_TOKEN': 'standin-experiment-token',
+    'CHANNEL_SECRET': 'standin-experiment-secret',
+    'CHANNEL_ACCESS_TOKEN_CONTROL': 'standin-control-token',
+    'CHANNEL_SECRET_CONTROL': 'standin-control-secret',
+    'LINE_DESTINATION': '',
+    'LINE_DESTINATION_CONTROL': '',
+    'OPENAI_API_KEY': 'standin-openai-key',
+    'ASSISTANT_ID': 'asst_standin',
+    'WEBHOOK_CAPTURE': '',
+}
+
+def install(firestore_latency=0.0, line_latency=0.0, openai_latency=0.0, run_seconds=2.0, firestore_emulator=False):
+    # Replace the service clients of a fresh interpreter with local stand-ins, then return the engines.
+    # With firestore_emulator, Firestore is the emulator at FIRESTORE_EMULATOR_HOST instead of the in-memory store.
+    os.environ.update(STANDIN_ENV)
+    if firestore_emulator:
+        if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+            raise ValueError("FIRESTORE_EMULATOR_HOST is not set. Start it with: firebase emulators:start --only firestore")
+        from google.cloud import firestore
+
+        db = firestore.Client(project=os.getenv('GCLOUD_PROJECT', 'demo-diabetes-linebot'))
+    else:
+        db = InMemoryFirestore(latency=firestore_latency)
+    realtime_db = InMemoryRealtimeDatabase({'name': [], 'message': None})
+    sys.modules['firebase'] = types.SimpleNamespace(db=db, realtime_db=realtime_db)
+
+    import assistant
+    from linebot_experiment import engine as experiment_engine
+    from linebot_control import engine as control_engine
+
+    assistant.client = OpenAIStandin(latency=openai_latency, run_seconds=run_seconds)
+    line_bot_api = LineBotApiStandin(latency=line_latency)
+    engines = {'experiment': experiment_engine, 'control': control_engine}
+    for engine in engines.values():
+        engine.line_bot_api = line_bot_api
+    return types.SimpleNamespace(
+        db=db, realtime_db=realtime_db, openai=assistant.client, line_bot_api=line_bot_api, engines=engines
+    )
+
+
+class Request:
+    # Minimal https_fn.Request for calling the handlers directly
+    def __init__(self, body, signature, method='POST', args=None):
+        self.data = body.encode('utf-8')
+        self.headers = {'X-Line-Signature': signature, 'Content-Type': 'application/json'}
+        self.method = method
+        self.args = args or {}
+
+    def get_json(self, silent=False):
+        return json.loads(self.data)
+
+
+def webhook(user_id, kind, payload, event_id):
+    # Webhook body of one text message ('message') or postback ('postback') event
+    event = {
+        'type': kind, 'mode': 'active', 'timestamp': 0, 'replyToken': f"reply-{event_id}",
+        'source': {'type': 'user', 'userId': user_id}, 'webhookEventId': f"event-{event_id}",
+        'deliveryContext': {'isRedelivery': False},
+    }
+    if kind == 'message':
+        event['message'] = {'id': str(event_id), 'type': 'text', 'text': payload}
+    else:
+        event['postback'] = {'data': payload}
+    return json.dumps({'destination': '', 'events': [event]}, ensure_ascii=False)
@@ -0,0 +1,104 @@
+# Train the zstd dictionary of message_codec.py on stored conversations and report what it gains
+# Usage (from functions/):
+#   python -m tools.train_message_dictionary --collection users --collection users_control
+#   python -m tools.train_message_dictionary --collection users --evaluate 2718281828
+# Deploy the written data/message_dictionaries/<id>.zdict and set MESSAGE_DICTIONARY_ID=<id>.
+
+# Other modules import
+import argparse
+import json
+import os
+import random
+import time
+
+import zstandard
+
+from firebase import db
+from message_codec import MESSAGE_COMPRESSION_LEVEL, MESSAGE_COMPRESSION_MIN_BYTES, decode_messages, dictionary_path
+from tools.migrate_users import stream_pages
+
+# Share of the samples kept out of training to measure the dictionary on
+HOLDOUT = 0.2
+
+
+def collect_samples(collections, max_users, page_size=100):
+    samples = []
+    users = 0
+    for collection in collections:
+        for page in stream_pages(collection, page_size):
+            for snapshot in page:
+                for message in decode_messages(snapshot.to_dict().get('messages', [])):
+                    content = message.get('content')
+                    if isinstance(content, str) and content:
+                        samples.append(content.encode('utf-8'))
+                users += 1
+                if max_users and users >= max_users:
+                    return samples
+    return samples
+
+def measure(samples, dictionary=None, level=MESSAGE_COMPRESSION_LEVEL):
+    # Stored size and per-message cost of the samples above the size threshold, as the codec would store them
+    compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    raw = stored = compressed = 0
+    encode_seconds = decode_seconds = 0.0
+    for sample in samples:
+        raw += len(sample)
+        if len(sample) < MESSAGE_COMPRESSION_MIN_BYTES:
+            stored += len(sample)
+            continue
+        started = time.perf_counter()
+        data = compressor.compress(sample)
+        encode_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        decompressor.decompress(data)
+        decode_seconds += time.perf_counter() - started
+        if len(data) < len(sample):
+            stored += len(data)
+            compressed += 1
+        else:
+            stored += len(sample)
+    return {
+        'messages': len(samples),
+        'compressed': compressed,
+        'raw_bytes': raw,
+        'stored_bytes': stored,
+        'ratio': round(raw / stored, 2) if stored else None,
+        'encode_us': round(encode_seconds / compressed * 1e6, 1) if compressed else None,
+        'decode_us': round(decode_seconds / compressed * 1e6, 1) if compressed else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and evaluate the message compression dictionary')
+    parser.add_argument('--collection', action='append', required=True)
+    parser.add_argument('--max-users', type=int, default=0, help='stop after this many user documents (0 = all)')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='dictionary size in bytes')
+    parser.add_argument('--evaluate', help='only evaluate this existing dictionary ID')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = collect_samples(args.collection, args.max_users)
+    if not samples:
+        raise SystemExit("No message content found")
+    random.Random(args.seed).shuffle(samples)
+    split = int(len(samples) * (1 - HOLDOUT))
+    training, holdout = samples[:split], samples[split:]
+
+    if args.evaluate:
+        with open(dictionary_path(args.evaluate), 'rb') as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read())
+        holdout = samples
+    else:
+        dictionary = zstandard.train_dictionary(args.size, training)
+        os.makedirs(os.path.dirname(dictionary_path(dictionary.dict_id())), exist_ok=True)
+        with open(dictionary_path(dictionary.dict_id()), 'wb') as f:
+            f.write(dictionary.as_bytes())
+
+    print(json.dumps({
+        'dictionary_id': dictionary.dict_id(),
+        'dictionary_bytes': len(dictionary.as_bytes()),
+        'threshold_bytes': MESSAGE_COMPRESSION_MIN_BYTES,
+        'without_dictionary': measure(holdout),
+        'with_dictionary': measure(holdout, dictionary),
+    }, indent=2))
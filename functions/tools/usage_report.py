@@ -0,0 +1,31 @@
+# Daily Assistant usage report from the sharded usage counters
+# Usage (from functions/): python -m tools.usage_report --start 2026-05-01 --end 2026-05-31
+
+# Other modules import
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from usage import get_usage_totals
+
+
+def daterange(start, end):
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    while day <= last:
+        yield day.strftime("%Y-%m-%d")
+        day += timedelta(days=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report Assistant runs, polls, tokens and run time per day')
+    parser.add_argument('--start', required=True, help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='last day, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    for date in daterange(args.start, args.end):
+        totals = get_usage_totals(date)
+        if totals['runs']:
+            totals['avg_run_seconds'] = round(totals['run_seconds'] / totals['runs'], 2)
+            totals['avg_polls'] = round(totals['polls'] / totals['runs'], 1)
+        print(json.dumps(totals))
@@ -0,0 +1,77 @@
+# Environment import
+import os
+from dotenv import load_dotenv
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Firebase import
+from firebase_admin import firestore
+from firebase import db
+
+# Other modules import
+import random
+from prewarm import STUDY_TIMEZONE
+
+# Load environment variables
+load_dotenv()
+
+# Global counters are split over shards so concurrent runs don't contend on one document
+USAGE_COUNTER_SHARDS = int(os.getenv('USAGE_COUNTER_SHARDS', '10'))
+USAGE_COUNTERS_COLLECTION = 'usage_counters'
+USAGE_FIELDS = ['runs', 'polls', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'run_seconds']
+
+
+def usage_increments(runs):
+    return {
+        'runs': len(runs),
+        'polls': sum(run['polls'] for run in runs),
+        'prompt_tokens': sum(run['prompt_tokens'] for run in runs),
+        'completion_tokens': sum(run['completion_tokens'] for run in runs),
+        'total_tokens': sum(run['total_tokens'] for run in runs),
+        'run_seconds': round(sum(run['duration'] for run in runs), 3),
+    }
+
+def record_run_usage(collection, user_id, runs, deadline):
+    # Ledger of every Assistant run per user, plus per-user and global daily totals
+    if not runs:
+        return
+    now = datetime.now()
+    # Daily totals follow the participants' day, not the server's UTC one
+    date = datetime.now(ZoneInfo(STUDY_TIMEZONE)).strftime("%Y-%m-%d")
+    increments = usage_increments(runs)
+
+    batch = db.batch()
+    user_ref = db.collection(collection).document(user_id)
+    for run in runs:
+        batch.set(user_ref.collection('usage').document(run['run_id']), dict(
+            run,
+            date=date,
+            create_at=now.strftime("%Y-%m-%d %H:%M:%S")
+        ))
+    batch.set(user_ref.collection('usage_daily').document(date), dict(
+        {field: firestore.Increment(value) for field, value in increments.items()},
+        date=date
+    ), merge=True)
+    shard = random.randrange(USAGE_COUNTER_SHARDS)
+    shard_ref = db.collection(USAGE_COUNTERS_COLLECTION).document(date).collection('shards').document(str(shard))
+    batch.set(shard_ref, {field: firestore.Increment(value) for field, value in increments.items()}, merge=True)
+    batch.commit(timeout=deadline.timeout('firestore.record_usage', reserve=0))
+
+def get_usage_totals(date):
+    # Aggregate the shards of one day on read
+    totals = {field: 0 for field in USAGE_FIELDS}
+    shards = db.collection(USAGE_COUNTERS_COLLECTION).document(date).collection('shards').stream()
+    for shard in shards:
+        data = shard.to_dict()
+        for field in USAGE_FIELDS:
+            totals[field] += data.get(field, 0)
+    totals['date'] = date
+    return totals
+
+def get_user_usage(collection, user_id, start_date, end_date):
+    # Per-user daily totals between two dates (YYYY-MM-DD, inclusive)
+    days = db.collection(collection).document(user_id).collection('usage_daily') \
+        .where(filter=firestore.FieldFilter('date', '>=', start_date)) \
+        .where(filter=firestore.FieldFilter('date', '<=', end_date)) \
+        .stream()
+    return [day.to_dict() for day in days]